@@ -4,9 +4,14 @@
 __author__ = 'Vincent Verheul'
 __version__ = '2025-05-26'
 
+from .boot import boot_started   # first, before the heavy imports
 import sys
+import queue
+import threading
+import atexit
 import logging
-# from logging.handlers import RotatingFileHandler
+from time import monotonic
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from flask import Flask  # current_app
 from flask_sqlalchemy import SQLAlchemy
 from .flaskconfig import FlaskConfig
@@ -21,7 +26,8 @@ class CustomLogFormatter(logging.Formatter):
     bold_red = '\x1b[31;1m'
     reset = '\x1b[0m'
     regular = reset
-    log_format = '%(asctime)s %(levelname)s %(message)s'
+    log_format = '%(asctime)s %(levelname)s %(message)s%(suppressed)s'
+    log_defaults = {'suppressed': ''}   # set by RateLimitFilter on a record which follows suppressed ones
 
     formats = {
         logging.DEBUG: f'{grey}{log_format}{reset}',
@@ -31,23 +37,68 @@ class CustomLogFormatter(logging.Formatter):
         logging.CRITICAL: f'{bold_red}{log_format}{reset}'
     }
 
+    def __init__(self):
+        super().__init__()
+        self.formatters = {level: logging.Formatter(log_fmt, defaults=self.log_defaults)
+                           for level, log_fmt in self.formats.items()}
+        self.default_formatter = logging.Formatter()
+
     def format(self, record):
-        log_fmt = self.formats.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
-        return formatter.format(record)
+        return self.formatters.get(record.levelno, self.default_formatter).format(record)
+
+
+class RateLimitFilter(logging.Filter):
+    """ Pass at most burst debug records per interval seconds from the same line of code. The number of
+        suppressed records is set in the suppressed attribute of the next record that passes, for the formatter.
+        Other levels always pass. """
+
+    def __init__(self, burst: int, interval: float):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.windows = dict()   # (pathname, lineno): [window start, records passed, records suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        now = monotonic()
+        with self.lock:
+            window = self.windows.get((record.pathname, record.lineno))
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self.windows[(record.pathname, record.lineno)] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = f' ({suppressed} similar suppressed)'
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
 
 
 def set_logger():
+    """ The anchorapp logger puts the records in a queue, a listener thread writes them to the console and,
+        when FlaskConfig.log_file is set, to a size-rotating file. Logging thus never waits for I/O. """
     logger = logging.getLogger('anchorapp')  # 'werkzeug'
     logger.setLevel(logging.DEBUG)
     console_handler = logging.StreamHandler(stream=sys.stdout)
-    # log_format = '%(asctime)s %(levelname)s %(message)s'
-    # console_handler.setFormatter(logging.Formatter(log_format))
     console_handler.setFormatter(CustomLogFormatter())
-    # file_handler = RotatingFileHandler(filename='anchorapp.log', maxBytes=1024 * 1024, backupCount=5, encoding='UTF8')
-    # file_handler.setFormatter(logging.Formatter(log_format))
-    logger.addHandler(console_handler)
-    # logger.addHandler(file_handler)
+    handlers = [console_handler]
+    if FlaskConfig.log_file:
+        file_handler = RotatingFileHandler(filename=FlaskConfig.log_file, maxBytes=FlaskConfig.log_file_max_bytes,
+                                           backupCount=FlaskConfig.log_file_backups, encoding='UTF8')
+        file_handler.setFormatter(logging.Formatter(CustomLogFormatter.log_format,
+                                                    defaults=CustomLogFormatter.log_defaults))
+        handlers.append(file_handler)
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(FlaskConfig.log_debug_burst, FlaskConfig.log_debug_interval))
+    logger.addHandler(queue_handler)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)   # writes the records still in the queue
     return logger
 
 
@@ -61,11 +112,20 @@ def create_app(config_class=FlaskConfig):
     flask_app.config.from_object(config_class)
 
     db.init_app(flask_app)
+    with flask_app.app_context():
+        from .models.db_model import set_storage_profile
+        set_storage_profile(db.engine, config_class.sqlite_pragmas)
 
     from .app_logic.main import main
     from .app_logic.error_handlers import errors
+    from .app_logic.metrics import metrics
+    from .app_logic.assets import assets
+    from .app_logic.api import api
 
     flask_app.register_blueprint(main)
     flask_app.register_blueprint(errors)
+    flask_app.register_blueprint(metrics)
+    flask_app.register_blueprint(assets)
+    flask_app.register_blueprint(api)
 
     return flask_app
@@ -1,11 +1,12 @@
 #!/usr/bin/python3
 
 __package__ = 'anchorapp'
-from . import create_app
+from . import create_app, FlaskConfig
+from .server import run_server
 
 app = create_app()
 app.app_context().push()
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    run_server(app, FlaskConfig.server_mode, host='localhost', port=5000, debug=True)
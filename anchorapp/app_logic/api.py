@@ -0,0 +1,74 @@
+""" JSON API for the control pages and other clients. Every call returns a compact snapshot of the windlass
+    state and the relevant buttons, so a client can update in place instead of reloading the page. """
+
+from flask import Blueprint, request, session
+from .. import log
+from .util import Glob, in_control, is_number, write_event
+from ..models.db_model import Action
+from .main import (ANCHOR_ACTIONS, anchor_action, complete_run, control_state, set_target_length,
+                   start_windlass_thread, start_temp_monitor)
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def status_snapshot(message: tuple[str, str] = None) -> dict:
+    """ Windlass state, button states and optionally a (message, category) to show """
+    snapshot = {'target_length': int(Glob.windlass.target_length),
+                'actual_length': round(Glob.windlass.actual_length, 1),
+                'running': Glob.windlass.running,
+                'paused': Glob.windlass.paused,
+                'site': Glob.anchor_site.refname,
+                'control': in_control()}
+    snapshot |= control_state(session.get('theme') == 'dark')
+    if message:
+        snapshot['message'], snapshot['category'] = message
+    return snapshot
+
+
+def error(msg: str, status: int):
+    log.debug(f'api.error - {status} {msg}')
+    return {'error': msg} | status_snapshot(), status
+
+
+@api.route('/status')
+def status():
+    """ Current state, books the completed run like the home page does """
+    Glob.load_master_db_records()
+    complete_run()
+    if not Glob.windlass_running:
+        start_windlass_thread()
+    if not Glob.temp_monitor_running:
+        start_temp_monitor()
+    return status_snapshot()
+
+
+@api.route('/anchor/<string:action>', methods=['POST'])
+def anchor(action: str):
+    """ Anchor up, down, pause or resume """
+    if not in_control():
+        return error('Not in control', 403)
+    if action not in ANCHOR_ACTIONS:
+        return error(f'Invalid anchor action: "{action}"', 404)
+    return status_snapshot(anchor_action(action))
+
+
+@api.route('/target', methods=['POST'])
+def target():
+    """ Set the target length for the current site from JSON {"depth": 6.5, "add_safety": false}
+        or go anchor up with {"go_anchor_up": true} """
+    if not in_control():
+        return error('Not in control', 403)
+    if Glob.windlass.running:
+        return error('Anchor is running, pause first', 409)
+    data = request.get_json(silent=True) or dict()
+    Glob.load_master_db_records()
+    go_anchor_up = bool(data.get('go_anchor_up', False))
+    depth = str(data.get('depth', ''))
+    depth = float(depth) if is_number(depth) else 0.0
+    min_depth = Glob.boat_config.min_anchor_depth()
+    max_depth = Glob.boat_config.max_anchor_depth()
+    if not go_anchor_up and not min_depth <= depth <= max_depth:
+        return error(f'Depth must be between {min_depth} and {max_depth} meter', 400)
+    set_target_length(Glob.anchor_site_record(), depth, bool(data.get('add_safety', False)), go_anchor_up)
+    write_event(Action.SET_TARGET)
+    return status_snapshot()
@@ -0,0 +1,139 @@
+""" Static assets with a content hash in the file name, precompressed with gzip and, when the optional brotli
+    library is installed, with brotli. The fingerprinted files never change, so the browser may cache them
+    for a year without revalidating. The files are built into static/dist when the sources have changed. """
+
+import os
+import json
+import gzip
+import shutil
+import hashlib
+import mimetypes
+from flask import Blueprint, request, url_for, send_from_directory, abort
+from .. import log
+
+COMPRESS_TYPES = ('text/css', 'text/javascript', 'application/javascript', 'image/svg+xml')
+CACHE_SECS = 365 * 24 * 3600
+
+
+def compress_brotli(data: bytes) -> bytes | None:
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data, quality=11)
+
+
+def compress_gzip(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+ENCODINGS = (('br', '.br', compress_brotli), ('gzip', '.gz', compress_gzip))   # in order of preference
+
+
+class AssetManifest:
+    """ Source file name: fingerprinted file name and the available encodings """
+
+    def __init__(self):
+        self.entries = dict()
+        self.files = dict()      # fingerprinted file name: encodings
+        self.dist_folder = None
+
+    def __repr__(self):
+        return f'AssetManifest(assets={len(self.entries)})'
+
+    @staticmethod
+    def sources(static_folder: str) -> dict:
+        """ File name: (size, mtime) of the source files in the static folder """
+        return {entry.name: (entry.stat().st_size, entry.stat().st_mtime_ns)
+                for entry in os.scandir(static_folder) if entry.is_file()}
+
+    def load(self, static_folder: str):
+        """ Read the manifest, rebuild the assets when a source file was added, removed or changed """
+        self.dist_folder = os.path.join(static_folder, 'dist')
+        sources = self.sources(static_folder)
+        try:
+            with open(os.path.join(self.dist_folder, 'manifest.json')) as file:
+                manifest = json.load(file)
+            if {name: tuple(stat) for name, stat in manifest['sources'].items()} == sources:
+                self.set_entries(manifest['assets'])
+                return
+        except (OSError, ValueError, KeyError):
+            pass
+        try:
+            self.build(static_folder, sources)
+        except OSError as err:
+            log.warning(f'assets.load - not built, serving the plain static files: {err}')
+
+    def build(self, static_folder: str, sources: dict):
+        """ Write the fingerprinted and compressed files and the manifest into the dist folder """
+        shutil.rmtree(self.dist_folder, ignore_errors=True)
+        os.makedirs(self.dist_folder)
+        entries = dict()
+        for name in sorted(sources):
+            with open(os.path.join(static_folder, name), 'rb') as file:
+                data = file.read()
+            stem, ext = os.path.splitext(name)
+            hashed_name = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+            self.write(hashed_name, data)
+            encodings = []
+            if mimetypes.guess_type(name)[0] in COMPRESS_TYPES:
+                for encoding, suffix, compress in ENCODINGS:
+                    compressed = compress(data)
+                    if compressed is not None and len(compressed) < len(data):
+                        self.write(hashed_name + suffix, compressed)
+                        encodings.append(encoding)
+            entries[name] = {'file': hashed_name, 'encodings': encodings}
+        with open(os.path.join(self.dist_folder, 'manifest.json'), 'w') as file:
+            json.dump({'sources': sources, 'assets': entries}, file, indent=1)
+        self.set_entries(entries)
+        log.info(f'assets.build - built {len(entries)} assets in {self.dist_folder}')
+
+    def write(self, name: str, data: bytes):
+        with open(os.path.join(self.dist_folder, name), 'wb') as file:
+            file.write(data)
+
+    def set_entries(self, entries: dict):
+        self.entries = entries
+        self.files = {entry['file']: entry['encodings'] for entry in entries.values()}
+
+
+manifest = AssetManifest()   # instantiate (singleton) here to make it available to other modules
+
+assets = Blueprint('assets', __name__)
+
+
+@assets.record_once
+def load_manifest(state):
+    manifest.load(state.app.static_folder)
+
+
+@assets.app_template_global()
+def asset_url(filename: str) -> str:
+    """ URL of the fingerprinted asset, the plain static URL when the file is not in the manifest """
+    entry = manifest.entries.get(filename)
+    if entry is None:
+        return url_for('static', filename=filename)
+    return url_for('assets.asset', filename=entry['file'])
+
+
+@assets.route('/assets/<string:filename>')
+def asset(filename: str):
+    """ Serve a fingerprinted asset in the best encoding the browser accepts, to be cached for a year """
+    encodings = manifest.files.get(filename)
+    if encodings is None:
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    content_encoding = None
+    file_name = filename
+    for encoding, suffix, _ in ENCODINGS:
+        if encoding in encodings and request.accept_encodings[encoding] > 0:   # q=0: refused by the browser
+            content_encoding = encoding
+            file_name = filename + suffix
+            break
+    response = send_from_directory(manifest.dist_folder, file_name, mimetype=mimetype, max_age=CACHE_SECS)
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
@@ -0,0 +1,68 @@
+""" Calibration of the windlass down and up speeds from the event history. A run event followed by an
+    Adjust actual event tells how far the chain really moved in the run: the corrected length minus the
+    length at the start of the run. A least squares fit of these distances against the run durations,
+    through the origin, gives the speed per direction. The duration is the relay on time from the telemetry
+    of the run. Runs without telemetry are skipped: their end time is stamped when the run is booked, after
+    the relay was switched off. """
+
+from statistics import linear_regression, StatisticsError
+from sqlalchemy import select
+from .. import db, log
+from ..models.db_model import SiteEvent, Action
+from .telemetry import unpack
+
+MIN_SAMPLES = 3          # corrected runs needed per direction to fit a speed
+MAX_EVENTS = 2000        # most recent events of the boat to scan
+RUN_ACTIONS = (Action.DOWN_TO_TARGET.value, Action.UP_TO_TARGET.value,
+               Action.DOWN_MANUAL.value, Action.UP_MANUAL.value)
+
+
+def run_seconds(event) -> float | None:
+    """ Relay on time of a run from its telemetry, None without telemetry """
+    if not event.telemetry:
+        return None
+    samples = unpack(event.telemetry)['samples']
+    return samples[-1]['t'] if samples else None
+
+
+def corrected_runs(boat_id: int):
+    """ Generate (direction, run seconds, corrected distance) for each run directly followed by an adjustment
+        of the actual length at the same site """
+    query = (select(SiteEvent.id, SiteEvent.site_id, SiteEvent.action, SiteEvent.start_actual_length,
+                    SiteEvent.telemetry)
+             .where(SiteEvent.boat_id == boat_id)
+             .where(SiteEvent.action.in_(RUN_ACTIONS + (Action.ADJUST_ACTUAL.value, Action.INITIAL_VALUE.value)))
+             .order_by(SiteEvent.id.desc())
+             .limit(MAX_EVENTS))
+    events = db.session.execute(query).all()
+    events.reverse()
+    for run, correction in zip(events, events[1:]):
+        if run.action not in RUN_ACTIONS or correction.action != Action.ADJUST_ACTUAL.value:
+            continue
+        if run.site_id != correction.site_id or run.start_actual_length is None:
+            continue
+        direction = 1 if Action(run.action) in (Action.DOWN_TO_TARGET, Action.DOWN_MANUAL) else -1
+        distance = (correction.start_actual_length - run.start_actual_length) * direction
+        secs = run_seconds(run)
+        if distance > 0 and secs:
+            yield direction, secs, distance
+
+
+def fit_speeds(boat_id: int) -> dict:
+    """ Fitted down and up speeds in m/min with the number of runs used, speed None when not enough runs """
+    samples = {1: ([], []), -1: ([], [])}
+    for direction, secs, distance in corrected_runs(boat_id):
+        samples[direction][0].append(secs)
+        samples[direction][1].append(distance)
+    result = {}
+    for direction, name in ((1, 'down'), (-1, 'up')):
+        durations, distances = samples[direction]
+        speed = None
+        if len(durations) >= MIN_SAMPLES:
+            try:
+                speed = round(linear_regression(durations, distances, proportional=True).slope * 60, 1)
+            except StatisticsError as err:
+                log.debug(f'calibration.fit_speeds - {name}: {err}')
+        result[name] = {'speed': speed, 'runs': len(durations)}
+    log.debug(f'calibration.fit_speeds - boat {boat_id}: {result}')
+    return result
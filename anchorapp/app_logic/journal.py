@@ -0,0 +1,194 @@
+import atexit
+import threading
+from time import perf_counter
+from collections import deque
+from flask import current_app
+from .. import db, log
+from ..models.db_model import SiteEvent, Action
+
+
+class JournalEntry:
+    """ SiteEvent queued in the journal, the id is known after the writer has inserted the record """
+
+    def __init__(self, values: dict):
+        self.values = values
+        self.id = None
+
+    def __repr__(self):
+        return f'JournalEntry(id={self.id}, action={Action(self.action).name})'
+
+    @property
+    def action(self) -> int:
+        return self.values['action']
+
+
+class EventJournal:
+    """ Write-behind journal of the SiteEvent records. Events are queued in memory and a writer thread
+        commits them in batches: one transaction per batch_msecs or per batch_size events, whichever
+        comes first. The request threads therefore never wait for the database on writing an event.
+        A failed batch is retried, after max_attempts its operations are committed one by one and the
+        ones which still fail are kept in failed. """
+
+    def __init__(self, batch_msecs=250, batch_size=20, max_attempts=3):
+        self.batch_secs = batch_msecs / 1000
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.pending = deque()                   # operations waiting for the writer
+        self.condition = threading.Condition()
+        self.app = None                          # Flask app, to run the writer in an app context
+        self.writer = None                       # thread running the writer
+        self.in_flight = 0                       # operations in the transaction being committed
+        self.attempts = 0                        # failed commits of the batch at the head of the queue
+        self.failed = list()                     # operations which could not be committed
+        self.flush_requested = False
+        self.stopped = False
+        self.commits = 0
+        self.events_written = 0
+        self.last_commit_ms = None
+        self.max_commit_ms = 0.0
+
+    def __repr__(self):
+        return f'EventJournal(queue_depth={self.queue_depth}, commits={self.commits})'
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.pending) + self.in_flight
+
+    def stats(self) -> dict:
+        """ Queue depth and commit latency """
+        return {'queue_depth': self.queue_depth, 'commits': self.commits, 'events_written': self.events_written,
+                'last_commit_ms': self.last_commit_ms, 'max_commit_ms': self.max_commit_ms, 'failed': len(self.failed)}
+
+    def append(self, **values) -> JournalEntry:
+        """ Queue a new SiteEvent with the column values """
+        entry = JournalEntry(values)
+        self.put(('insert', entry, values))
+        return entry
+
+    def update(self, entry: JournalEntry, **values):
+        """ Queue an update of the columns of a SiteEvent appended before """
+        self.put(('update', entry, values))
+
+    def update_next(self, entry: JournalEntry, action: Action, **values):
+        """ Queue an update of the SiteEvent directly following entry, when it has the given action """
+        self.put(('update_next', entry, values, action))
+
+    def put(self, operation: tuple):
+        with self.condition:
+            if self.writer is None:
+                self.start(current_app._get_current_object())  # noqa
+            self.pending.append(operation)
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify_all()
+
+    def start(self, app):
+        """ Start the writer thread, the app provides the database session """
+        self.app = app
+        self.stopped = False
+        self.writer = threading.Thread(target=self.run_writer, daemon=True)
+        self.writer.start()
+        log.debug('journal.start - writer started')
+
+    def flush(self, timeout=5.0) -> bool:
+        """ Write all queued events now and wait until they are committed """
+        with self.condition:
+            if not self.pending and not self.in_flight:
+                return True
+            self.flush_requested = True
+            self.condition.notify_all()
+            done = self.condition.wait_for(lambda: not self.pending and not self.in_flight, timeout)
+            self.flush_requested = False
+        if not done:
+            log.warning(f'journal.flush - not completed within {timeout} secs, {self.queue_depth} waiting')
+        return done
+
+    def stop(self):
+        """ Flush the queue and stop the writer """
+        if self.writer is None:
+            return
+        self.flush()
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.writer.join(timeout=5.0)
+        self.writer = None
+
+    def run_writer(self):
+        """ Wait for the first event, collect a batch and commit it in one transaction """
+        with self.app.app_context():
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.pending or self.stopped)
+                    if self.stopped and not self.pending:
+                        break
+                    self.condition.wait_for(lambda: len(self.pending) >= self.batch_size or self.flush_requested
+                                            or self.stopped, timeout=self.batch_secs)
+                    batch = list(self.pending)
+                    self.pending.clear()
+                    self.in_flight = len(batch)
+                try:
+                    self.commit_batch(batch)
+                    self.attempts = 0
+                except Exception as err:     # keep the writer alive, whatever went wrong
+                    self.retry_batch(batch, err)
+                finally:
+                    with self.condition:
+                        self.in_flight = 0
+                        self.condition.notify_all()
+        log.debug('journal.run_writer - writer stopped')
+
+    def retry_batch(self, batch: list, err: Exception):
+        """ Queue a failed batch again, after max_attempts commit its operations one by one and keep the failures """
+        self.attempts += 1
+        if self.attempts < self.max_attempts:
+            log.warning(f'journal.retry_batch - commit of {len(batch)} operations failed, retry: {err}')
+            with self.condition:
+                self.pending.extendleft(reversed(batch))
+            return
+        self.attempts = 0
+        for operation in batch:
+            try:
+                self.commit_batch([operation])
+            except Exception as op_err:
+                self.failed.append(operation)
+                log.error(f'journal.retry_batch - {operation[0]} of {operation[1]} failed, kept in failed: {op_err}')
+
+    def commit_batch(self, batch: list):
+        """ Apply the operations and commit them in one transaction, roll back and raise on failure """
+        start = perf_counter()
+        try:
+            for operation in batch:
+                self.apply(*operation)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            for operation in batch:
+                if operation[0] == 'insert':
+                    operation[1].id = None       # the insert was rolled back
+            raise
+        self.last_commit_ms = round((perf_counter() - start) * 1000, 2)
+        self.max_commit_ms = max(self.max_commit_ms, self.last_commit_ms)
+        self.commits += 1
+        self.events_written += sum(1 for operation in batch if operation[0] == 'insert')
+
+    @staticmethod
+    def apply(kind: str, entry: JournalEntry, values: dict, action: Action = None):
+        """ Apply one operation to the session of the writer """
+        if kind == 'insert':
+            site_event = SiteEvent(**values)
+            db.session.add(site_event)
+            db.session.flush()
+            entry.id = site_event.id
+            return
+        if entry.id is None:
+            log.warning(f'journal.apply - {kind} skipped, {entry} was not written')
+            return
+        site_event = db.session.get(SiteEvent, entry.id + 1 if kind == 'update_next' else entry.id)
+        if site_event is None or (action is not None and site_event.action != action.value):
+            return
+        for key, value in values.items():
+            setattr(site_event, key, value)
+
+
+journal = EventJournal()   # instantiate (singleton) here to make it available to other modules
+atexit.register(journal.stop)
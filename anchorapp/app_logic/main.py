@@ -1,19 +1,30 @@
 
 # import os
 # import signal
+import json
 import platform
 import threading
-from time import sleep
+from time import sleep, monotonic, perf_counter
 from decimal import Decimal
 from datetime import date, datetime, timedelta
-from flask import render_template, redirect, url_for, Blueprint, Response, request, flash, session  # current_app
-from .. import __version__, log, db  # scheduler
+from sqlalchemy import select, func, or_, and_
+from flask import (render_template, redirect, url_for, Blueprint, Response, request, flash, session,  # current_app
+                   stream_template, stream_with_context, abort)
+from .. import __version__, log, db, boot_started  # scheduler
 from ..models.db_model import ConfigBoat, Site, SiteEvent, Action  # User, ConfigApp
 from ..flaskconfig import FlaskConfig
-from .util import (Glob, visitor_ip, set_visitor_control, in_control, get_user, get_route,
-                   is_number, write_event, update_event, run_os_command, cpu_temperature)
-from ..models.forms import ConfigAppForm, ConfigBoatForm, HomeForm, TargetForm, SiteSelectForm
+from .util import (Glob, visitor_ip, set_visitor_control, in_control, get_user_id, get_route, is_number,
+                   write_event, write_pause_event, complete_pause_event, keep_run_event, update_event,
+                   run_after_response, run_os_command, cpu_temperature)
+from ..models.forms import ConfigAppForm, ConfigBoatForm, HomeForm, TargetForm, SiteSelectForm, CalibrateForm
 from .windlass import relay
+from .stream_hub import StreamHub
+from .journal import journal
+from .telemetry import unpack
+from .calibration import fit_speeds
+from .thermal import thermal_controller, read_throttled
+from .metrics import registry, ARRIVAL_KEY
+from .assets import asset_url
 
 
 main = Blueprint('main', __name__)
@@ -42,6 +53,7 @@ def start_windlass_thread():
     """ Start the windlass listener """
     Glob.load_master_db_records()
     set_windlass_param()
+    Glob.windlass.clear_commands()
     thread = threading.Thread(target=windlass_thread, daemon=True)
     thread.start()
     Glob.windlass_running = thread
@@ -52,19 +64,21 @@ def temp_monitor_thread():
     log.info('start temp_monitor thread')
     if not relay.connected:
         relay.connect()
-    temp_c = 0.0
-    while relay.connected and temp_c > -1.0:
-        if not Glob.cpu_temp_monitor:
-            print('cpu_temp_monitor is False, sleep 60 secs')
-            sleep(60)
+    while relay.connected:
         temp_c = cpu_temperature()
-        if temp_c >= Glob.cpu_temp_high and not relay.rpi_fan_switch.is_active:
-            relay.rpi_fan_switch.on()
-            log.debug(f'CPU temperature is {temp_c} with upper threshold {Glob.cpu_temp_high}, fan switched on')
-        elif temp_c <= Glob.cpu_temp_target and relay.rpi_fan_switch.is_active:
-            relay.rpi_fan_switch.off()
-            log.debug(f'CPU temperature is {temp_c} with lower threshold {Glob.cpu_temp_target}, fan switched off')
-        sleep(20)
+        if temp_c <= -1.0:               # sensor not available now, no reading to record, try again later
+            sleep(FlaskConfig.thermal_sample_secs)
+            continue
+        fan_on = thermal_controller.update(monotonic(), temp_c, Glob.cpu_temp_high, Glob.cpu_temp_target,
+                                           read_throttled())
+        if Glob.cpu_temp_monitor and fan_on != relay.rpi_fan_switch.is_active:
+            if fan_on:
+                relay.rpi_fan_switch.on()
+            else:
+                relay.rpi_fan_switch.off()
+            log.debug(f'CPU temperature is {temp_c} with thresholds {Glob.cpu_temp_target}-{Glob.cpu_temp_high}, '
+                      f'fan switched {"on" if fan_on else "off"}')
+        sleep(FlaskConfig.thermal_sample_secs)
     log.info('stop temp_monitor thread')
 
 
@@ -93,36 +107,66 @@ def control(action: str):
     return render_template('control.html', dark=session.get('theme') == 'dark', action=action)
 
 
+def stream_sample() -> str | None:
+    """ Actual chain length for the stream, -1000 to signal completion or None to close the stream """
+    if Glob.windlass.quit:
+        return None
+    if Glob.windlass.signal_completed and not Glob.windlass.is_busy():
+        return '-1000'
+    return str(round(Glob.windlass.actual_length, 1))
+
+
+def state_sample() -> str | None:
+    """ Windlass state as JSON for the websocket clients, or None to close the channel """
+    if Glob.windlass.quit:
+        return None
+    return json.dumps({'target_length': Glob.windlass.target_length,
+                       'actual_length': round(Glob.windlass.actual_length, 1),
+                       'running': Glob.windlass.running, 'paused': Glob.windlass.paused,
+                       'completed': Glob.windlass.signal_completed and not Glob.windlass.is_busy()})
+
+
+stream_hub = StreamHub(stream_sample)
+state_hub = StreamHub(state_sample)
+registry.gauge('anchorapp_stream_subscribers', 'Connected event stream clients', lambda: stream_hub.subscriber_count)
+registry.gauge('anchorapp_websocket_clients', 'Connected websocket clients', lambda: state_hub.subscriber_count)
+registry.gauge('anchorapp_journal_queue_depth', 'Site events waiting to be written', lambda: journal.queue_depth)
+
+
 @main.route('/stream_actual')
 def actual_length_updater():
     """ Send a stream to the client to update the actual chain length: use an EventSource in JavaScript """
-    def stream_gen():
-        # log.debug(f'stream endpoint was called')
-        init = True
-        while not Glob.windlass.quit:
-            if Glob.windlass.running:
-                sleep(0.1)
-                yield f'data: {round(Glob.windlass.actual_length, 1)}\n\n'
-            elif init:
-                yield f'data: {round(Glob.windlass.actual_length, 1)}\n\n'
-                init = False
-            elif Glob.windlass.signal_completed:
-                yield f'data: -1000\n\n'
-            else:
-                sleep(0.5)
-    return Response(stream_gen(), mimetype='text/event-stream')
+    return Response(stream_hub.stream(), mimetype='text/event-stream')
 
 
 def pauze_anchor_action():
     """ Pauze anchor action immediately via relay and set windlass status afterwards """
-    if not in_control():
-        return
     if relay is not None and relay.connected:
         relay.anchor_dn_switch.off()
         relay.anchor_up_switch.off()
+    record_pause_latency()
     Glob.windlass.pause()
 
 
+def record_pause_latency():
+    """ Time from the arrival of the pause request until the relay was switched off, warn when over budget """
+    arrival = request.environ.get(ARRIVAL_KEY)
+    if arrival is None:
+        return
+    seconds = perf_counter() - arrival
+    registry.observe_pause(seconds)
+    Glob.pause_latency_ms = round(seconds * 1000, 2)
+    if Glob.pause_latency_ms > FlaskConfig.pause_budget_ms:
+        log.warning(f'pause - relay off {Glob.pause_latency_ms} ms after the request arrived, '
+                    f'budget is {FlaskConfig.pause_budget_ms} ms')
+
+
+def log_pause(entry):
+    """ Log the pause and complete its event, after the response of the pause """
+    log.info(f'anchor action: pause, relay off {Glob.pause_latency_ms} ms after arrival')
+    complete_pause_event(entry)
+
+
 def run_action_type(manual=False) -> Action:
     """ Action type depending on windlass target / actual """
     direction = Glob.windlass.run_direction()
@@ -135,58 +179,87 @@ def run_action_type(manual=False) -> Action:
     return action
 
 
-def anchor_up_disabled_msg():
+def anchor_up_disabled_msg() -> tuple[str, str]:
     msg = f'Anchor up is disabled (Config)'
     log.error(msg)
-    flash(msg, 'danger')
+    return msg, 'danger'
 
 
-@main.route('/anchor/<string:action>')
-def anchor(action: str):
-    """ Anchor up, down, pause, run/resume """
-    if not in_control():
-        return redirect(url_for('main.control', action='info'))
+ANCHOR_ACTIONS = ('up', 'down', 'pause', 'resume')
+
+
+def anchor_action(action: str) -> tuple[str, str] | None:
+    """ Anchor up, down, pause or run/resume, for a visitor in control.
+        Returns the (message, category) to show to the user, None when there is nothing to tell. """
+    if action == 'pause':                     # fast path: the relay first, only the log after the response
+        pauze_anchor_action()
+        entry = write_pause_event()           # the time and length at relay off, queued before any next command
+        Glob.new_target_set = False
+        run_after_response(lambda: log_pause(entry))
+        return None
     log.info(f'anchor action: {action}')
     if not Glob.windlass_running:
         log.warning('windlass thread was not running')
         start_windlass_thread()
+    message = None
     if action == 'resume':
         Glob.load_master_db_records()
         if Glob.windlass.run_direction() == -1 and not Glob.app_config.allow_achor_up:
-            anchor_up_disabled_msg()
+            message = anchor_up_disabled_msg()
         elif Glob.windlass.resume_enabled():
-            write_event(run_action_type())
+            entry = write_event(run_action_type())
             Glob.windlass.resume()
+            keep_run_event(entry)
     elif action == 'up':
         Glob.load_master_db_records()
         if not Glob.app_config.allow_achor_up:
-            anchor_up_disabled_msg()
+            message = anchor_up_disabled_msg()
         elif Glob.windlass.go_up(meters=Glob.app_config.manual_range):
-            write_event(run_action_type(manual=True))
+            keep_run_event(write_event(run_action_type(manual=True)))
+        elif Glob.windlass.reject_msg:
+            message = Glob.windlass.reject_msg, 'warning'
     elif action == 'down':
         Glob.load_master_db_records()
         if Glob.windlass.go_down(meters=Glob.app_config.manual_range):
-            write_event(run_action_type(manual=True))
-    elif action == 'pause':
-        pauze_anchor_action()
-        write_event(Action.PAUSE)
+            keep_run_event(write_event(run_action_type(manual=True)))
+        elif Glob.windlass.reject_msg:
+            message = Glob.windlass.reject_msg, 'warning'
     else:
-        msg = f'Invalid anchor action: "{action}"'
-        log.error(msg)
-        flash(msg, 'danger')
+        message = f'Invalid anchor action: "{action}"', 'danger'
+        log.error(message[0])
     Glob.new_target_set = False
+    return message
+
+
+@main.route('/anchor/<string:action>')
+def anchor(action: str):
+    """ Anchor up, down, pause, run/resume """
+    if not in_control():
+        return redirect(url_for('main.control', action='info'))
+    message = anchor_action(action)
+    if message:
+        flash(*message)
     return redirect(url_for('main.home'))
 
 
 def find_existing_sites(search_for='') -> dict:
     """ Find existing sites in recent events and return a dict with site_id and refname.
-        Optionally filter on search_for to be a partial string in the site refname (no wildcards). """
-    oldest = datetime.now() - timedelta(weeks=25)
+        Optionally filter on search_for to be a partial string in the site refname (no wildcards).
+        The sites are selected with one aggregated query and cached in Glob.recent_sites until a site changes. """
+    if Glob.recent_sites is None or monotonic() - Glob.recent_sites_time > Glob.recent_sites_max_age:
+        journal.flush()
+        oldest = datetime.now() - timedelta(weeks=25)
+        recent = (select(Site.id, Site.refname)
+                  .join(SiteEvent, SiteEvent.site_id == Site.id)
+                  .where(SiteEvent.start_time >= oldest)
+                  .group_by(Site.id)
+                  .order_by(func.min(SiteEvent.id)))
+        Glob.recent_sites = {row.id: row.refname for row in db.session.execute(recent)}
+        Glob.recent_sites_time = monotonic()
     recent_sites = dict()
-    for event in SiteEvent.query.filter(SiteEvent.start_time >= oldest).all():
-        if event.site.id not in recent_sites:
-            if search_for and search_for in event.site.refname or not search_for:
-                recent_sites[event.site.id] = event.site.refname
+    for site_id, refname in Glob.recent_sites.items():
+        if search_for and search_for in refname or not search_for:
+            recent_sites[site_id] = refname
     return recent_sites
 
 
@@ -204,44 +277,59 @@ def site_choices(include_site_0=False, include_new_option=False):
     return choice_list
 
 
-def site_switch(form: TargetForm) -> bool:
-    """ Switch to a new or existing site, other than the current site, or edit existing site name """
+def site_switch(form: TargetForm) -> tuple[bool, Site]:
+    """ Switch to a new or existing site, other than the current site, or edit existing site name.
+        Returns switched and the site database record to update. """
     switched = False
     existing = dict()
+    site = Glob.anchor_site_record()
     if form.refname.data:
         if form.exist_site_id.data == -1:                                                # <edit site>
-            old_new_msg = f'from "{Glob.anchor_site.refname}" to "{form.refname.data}"'
-            Glob.anchor_site.refname = form.refname.data
-            Glob.anchor_site.time_stamp = Glob.ts_adjusted()
-            db.session.add(Glob.anchor_site)
-            db.session.commit()
+            old_new_msg = f'from "{site.refname}" to "{form.refname.data}"'
+            site.refname = form.refname.data
+            site.time_stamp = Glob.ts_adjusted()
+            Glob.save_master(site)
+            Glob.recent_sites = None
             log.info(f'site_switch - edit site name: {old_new_msg}')
-            return switched
+            return switched, Glob.anchor_site_record()
         else:
             existing = find_existing_sites(form.refname.data)
             for site_id in existing:
                 form.exist_site_id.data = site_id
     if not existing and form.exist_site_id.data == -2 and form.refname.data:             # <new site>
-        if form.refname.data != Glob.anchor_site.refname:
+        if form.refname.data != site.refname:
             switched = True
-            Glob.anchor_site = Site()
+            site = Site()
             log.debug(f'site_switch to new site: "{form.refname.data}"')
-        form.populate_obj(Glob.anchor_site)
-    elif form.exist_site_id.data >= 0 and form.exist_site_id.data != Glob.anchor_site.id:
+        form.populate_obj(site)
+    elif form.exist_site_id.data >= 0 and form.exist_site_id.data != site.id:
         switched = True
-        Glob.anchor_site = Site.query.get(form.exist_site_id.data)
-        Glob.site_id = form.exist_site_id.data
-        log.debug(f'site_switch to existing site: "{Glob.anchor_site}"')
-    return switched
+        site = db.session.get(Site, form.exist_site_id.data)
+        log.debug(f'site_switch to existing site: "{site}"')
+    return switched, site
 
 
 def save_site_selected():
     """ Save the selected site to the App Config record """
-    Glob.site_id = Glob.anchor_site.id
-    Glob.app_config.site_id = Glob.anchor_site.id
-    db.session.add(Glob.app_config)
-    db.session.commit()
-    log.debug(f'save_site_selected: "{Glob.anchor_site}"')
+    app_config = Glob.app_config_record()
+    app_config.site_id = Glob.site_id
+    Glob.save_master(app_config)
+    log.debug(f'save_site_selected: "{Glob.site_id}"')
+
+
+def set_target_length(site: Site, depth: float, add_safety: bool, go_anchor_up: bool):
+    """ Set the windlass target length for the anchor depth, or to go anchor up, and save it with the site """
+    site.user_id = get_user_id()
+    site.anchor_depth = depth
+    Glob.new_target_set = True
+    if go_anchor_up:
+        Glob.windlass.target_length = Glob.app_config.min_length_up
+    else:
+        Glob.windlass.target_length = Glob.boat_config.deploy_length(
+            depth, use_safety=add_safety, min_length_remain=Glob.app_config.min_length_up)
+    site.actual_length = Glob.windlass.actual_length if Glob.windlass.actual_length else 0.0
+    Glob.save_master(site)
+    Glob.site_id = site.id
 
 
 @main.route('/target', methods=['GET', 'POST'])
@@ -269,19 +357,9 @@ def set_target():
             form.exist_site_id.data = Glob.anchor_site.id
     elif form.validate_on_submit():
         log.debug('target - post')
-        changed_site = site_switch(form)
+        changed_site, site = site_switch(form)
         depth = float(form.anchor_depth.data) if is_number(str(form.anchor_depth.data)) else 0.0
-        Glob.anchor_site.user_id = get_user().id
-        Glob.anchor_site.anchor_depth = depth
-        Glob.new_target_set = True
-        if form.go_anchor_up.data:
-            Glob.windlass.target_length = Glob.app_config.min_length_up
-        else:
-            Glob.windlass.target_length = Glob.boat_config.deploy_length(
-                depth, use_safety=form.add_safety.data, min_length_remain=Glob.app_config.min_length_up)
-        Glob.anchor_site.actual_length = Glob.windlass.actual_length if Glob.windlass.actual_length else 0.0
-        db.session.add(Glob.anchor_site)
-        db.session.commit()
+        set_target_length(site, depth, form.add_safety.data, form.go_anchor_up.data)
         if changed_site:
             save_site_selected()
         write_event(Action.SET_TARGET)
@@ -292,12 +370,13 @@ def set_target():
 def save_site_actual_length():
     """ Save the actual deployed chain length to the current site and write to the database """
     Glob.load_master_db_records()
-    Glob.anchor_site.actual_length = round(Glob.windlass.actual_length, 1)
+    site = Glob.anchor_site_record()
+    site.actual_length = round(Glob.windlass.actual_length, 1)
     if Glob.app_config.site_id is None:
-        Glob.app_config.site_id = Glob.anchor_site.id
-        db.session.add(Glob.app_config)
-    db.session.add(Glob.anchor_site)
-    db.session.commit()
+        app_config = Glob.app_config_record()
+        app_config.site_id = site.id
+        db.session.add(app_config)
+    Glob.save_master(site)
 
 
 def get_site_actual_length():
@@ -318,6 +397,21 @@ def init_last_site() -> bool:
     return False
 
 
+def warm_up(flask_app):
+    """ Prepare what the first page needs before the server starts listening: the database connection, the
+        master records, the windlass and temperature monitor threads and the compiled templates.
+        Nothing is written on behalf of a visitor: on a new database the first request creates the master
+        records, and the first request writes the initial site event. """
+    with flask_app.app_context():
+        if Glob.master_records_exist():
+            start_windlass_thread()     # loads the master records
+        start_temp_monitor()
+    for name in flask_app.jinja_env.list_templates():
+        flask_app.jinja_env.get_template(name)
+    Glob.ready_secs = round(monotonic() - boot_started, 3)
+    log.info(f'warm_up - ready {Glob.ready_secs} secs after start')
+
+
 def adjust_values(form: HomeForm):
     """ Adjust windlass target / actual chain length and / or manual range """
     if not Glob.windlass.running and Glob.windlass.actual_length != form.actual_length.data:
@@ -334,10 +428,38 @@ def adjust_values(form: HomeForm):
     if form.manual_range.data != Decimal(Glob.app_config.manual_range):
         new_manual_range = float(form.manual_range.data)
         log.debug(f'adjust_values - Adjust manual range from {Glob.app_config.manual_range} to {new_manual_range}')
-        Glob.app_config.manual_range = new_manual_range
+        app_config = Glob.app_config_record()
+        app_config.manual_range = new_manual_range
+        Glob.save_master(app_config)
         write_event(Action.SET_MAN_RANGE)
-    db.session.add(Glob.app_config)
-    db.session.commit()
+
+
+def complete_run():
+    """ Book the windlass runs which signalled their completion, each on the event which started the run,
+        then the site and target reached. Not while the next run is going on: it books them all when done. """
+    if not Glob.windlass.signal_completed or Glob.windlass.is_busy():
+        return
+    Glob.windlass.signal_completed = False
+    log.debug('complete_run - reset windlass.signal_completed from True to False')
+    Glob.windlass.reset_manual_run()
+    entry = None
+    for run, length, ended in Glob.windlass.take_completed():
+        entry = update_event(run, length, ended)
+    save_site_actual_length()
+    curr_action = Action(entry.action) if entry else Action.UNDEFINED
+    if Glob.windlass.on_target() and curr_action.is_anchor_run(manual_run=False):
+        write_event(Action.TARGET_REACHED)
+
+
+def control_state(dark=False) -> dict:
+    """ Which control buttons are relevant to use and the direction image, for the control pages and the API """
+    direction_txt = Glob.windlass.direction_msg(use_target_actual=True, idle_as_blank=True)
+    image_file = f"chevrons-{'white' if dark else 'black'}-{direction_txt}.svg"
+    return {'set_ok': Glob.windlass.set_enabled(),
+            'run_ok': Glob.new_target_set and not Glob.windlass.on_target(),
+            'pause_ok': not Glob.new_target_set and Glob.windlass.pause_enabled(),
+            'resume_ok': not Glob.new_target_set and Glob.windlass.resume_enabled(),
+            'direction_img': asset_url(image_file) if direction_txt else ''}
 
 
 @main.route('/home')
@@ -350,15 +472,7 @@ def home():
     if Glob.initial_state:
         init_last_site()
     Glob.load_master_db_records()
-    if Glob.windlass.signal_completed:
-        Glob.windlass.signal_completed = False
-        log.debug('home - reset windlass.signal_completed from True to False')
-        Glob.windlass.reset_manual_run()
-        update_event()
-        save_site_actual_length()
-        curr_action = Action(Glob.site_event.action)
-        if Glob.windlass.on_target() and curr_action.is_anchor_run(manual_run=False):
-            write_event(Action.TARGET_REACHED)
+    complete_run()
     form = HomeForm()
     form.manual_range.render_kw['max'] = Decimal(Glob.app_config.max_manual_range)
     if request.method == 'GET':
@@ -375,16 +489,8 @@ def home():
         start_temp_monitor()
     control_status = Glob.visitor_control[visitor_ip()]
     dark = session.get('theme') == 'dark'
-    set_ok = Glob.windlass.set_enabled()
-    run_ok = Glob.new_target_set and not Glob.windlass.on_target()  # Glob.windlass.run_enabled()
-    pause_ok = not Glob.new_target_set and Glob.windlass.pause_enabled()
-    resume_ok = not Glob.new_target_set and Glob.windlass.resume_enabled()
-    direction_txt = Glob.windlass.direction_msg(use_target_actual=True, idle_as_blank=True)
-    image_file = f"chevrons-{'white' if dark else 'black'}-{direction_txt}.svg"
-    direction_img = url_for('static', filename=image_file) if direction_txt else ''
     template = 'control_basic.html' if Glob.app_config.basic_mode else 'control_full.html'
-    return render_template(template, dark=dark, control=control_status, set_ok=set_ok, run_ok=run_ok,
-                           pause_ok=pause_ok, resume_ok=resume_ok, direction_img=direction_img,
+    return render_template(template, dark=dark, control=control_status, **control_state(dark),
                            target=form.target_length.data, site=Glob.anchor_site.refname, form=form)
 
 
@@ -401,25 +507,73 @@ def help_text():
 def about():
     log.debug('about - get')
     temp_c = cpu_temperature()
-    return render_template('about.html', dark=session.get('theme') == 'dark', version=__version__, temp_c=temp_c)
-
-
-def get_site_events(site_id: int) -> list:
-    """ Select site events and format into a list of dicts """
-    if site_id != Glob.anchor_site.id:
-        site = Site.query.get(site_id)
-    else:
-        site = Glob.anchor_site
-    site_events = list()
+    return render_template('about.html', dark=session.get('theme') == 'dark', version=__version__, temp_c=temp_c,
+                           relay_latency_ms=Glob.windlass.relay_latency_ms, pause_latency_ms=Glob.pause_latency_ms,
+                           journal=journal.stats())
+
+
+@main.route('/ready')
+def ready():
+    """ Readiness probe: 200 once warmed up, else 503 """
+    if Glob.ready_secs is None:
+        return {'ready': False}, 503
+    return {'ready': True, 'boot_secs': Glob.ready_secs}
+
+
+@main.route('/thermal')
+def thermal():
+    """ CPU temperature readings, rate of rise and throttle events as JSON """
+    return thermal_controller.as_dict(monotonic()) | {'target': Glob.cpu_temp_target, 'high': Glob.cpu_temp_high,
+                                                      'monitor': Glob.cpu_temp_monitor}
+
+
+@main.route('/telemetry')
+def telemetry():
+    """ Samples of the current or last windlass run as JSON """
+    return Glob.windlass.telemetry.as_dict()
+
+
+@main.route('/telemetry/<int:event_id>')
+def event_telemetry(event_id: int):
+    """ Samples of the run of a site event as JSON """
+    journal.flush()
+    blob = db.session.scalar(select(SiteEvent.telemetry).where(SiteEvent.id == event_id))
+    if blob is None:
+        abort(404)
+    return {'event_id': event_id} | unpack(blob)
+
+
+def history_key(key: str) -> tuple | None:
+    """ Parse a history page key 'start_time_id' into a (start_time, id) tuple, None when not valid """
+    start_time, _, event_id = key.rpartition('_')
+    try:
+        return datetime.fromisoformat(start_time), int(event_id)
+    except ValueError:
+        return None
+
+
+def get_site_events(site_id: int, after: tuple = None, limit: int = None):
+    """ Select site events and format into dicts, generated one by one. The query selects only the columns shown,
+        ordered by start_time and id. Pass the (start_time, id) of the last event of a page as after
+        to continue with the next page of limit events. """
+    journal.flush()
+    query = (select(SiteEvent.id, SiteEvent.start_time, SiteEvent.action, SiteEvent.target_length,
+                    SiteEvent.start_actual_length, SiteEvent.end_actual_length)
+             .where(SiteEvent.site_id == site_id)
+             .order_by(SiteEvent.start_time, SiteEvent.id))
+    if after:
+        query = query.where(or_(SiteEvent.start_time > after[0],
+                                and_(SiteEvent.start_time == after[0], SiteEvent.id > after[1])))
+    if limit:
+        query = query.limit(limit)
     day_name = ('-', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
     prev_date = date(2000, 1, 1)
-    for event in site.events:
+    for event in db.session.execute(query.execution_options(yield_per=100)):
         curr_date = event.start_time.date()
         action = Action(event.action)
         if curr_date != prev_date:
             day = day_name[curr_date.isoweekday()]
-            rec = {'start_time': str(curr_date), 'action': day, 'actual_length': '', 'is_date': True}
-            site_events.append(rec)
+            yield {'start_time': str(curr_date), 'action': day, 'actual_length': '', 'is_date': True}
             prev_date = curr_date
         if action.name in ('SET_TARGET', 'ADJUST_TARGET'):
             length = event.target_length
@@ -427,35 +581,60 @@ def get_site_events(site_id: int) -> list:
             length = event.end_actual_length
         else:
             length = event.start_actual_length
-        if event.start_time.microsecond >= 500_000:
-            event.start_time += timedelta(seconds=1)
-        event.start_time.replace(microsecond=0)
-        site_events.append({
-            'start_time': str(event.start_time)[11:19],
+        start_time = event.start_time
+        if start_time.microsecond >= 500_000:
+            start_time += timedelta(seconds=1)
+        yield {
+            'start_time': str(start_time)[11:19],
             'action': action.name.lower().replace('_', ' '),
             'actual_length': length if action.is_length_relevant else '',
             'is_date': False,
-        })
-    return site_events
+            'key': f'{event.start_time.isoformat()}_{event.id}',
+        }
+
+
+def buffered(chunks, size=8192):
+    """ Join the small chunks of a streamed template into chunks of about size characters """
+    buffer = list()
+    length = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer.clear()
+            length = 0
+    if buffer:
+        yield ''.join(buffer)
 
 
 @main.route('/history', methods=['GET', 'POST'])
 def history():
-    """ Show history per selected site """
+    """ Show history per selected site, one page at a time or streamed all at once (?stream=1) """
     Glob.load_master_db_records()
     form = SiteSelectForm()
     site_choice_list = site_choices(include_site_0=True)
     form.site_id.choices = site_choice_list
-    site_events = list()
-    if request.method == 'GET':
-        log.debug(f'history - get: site_id={Glob.anchor_site.id}')
-        form.site_id.data = Glob.anchor_site.id
-        site_events = get_site_events(Glob.anchor_site.id)
-    elif form.validate_on_submit():
+    site_id = request.args.get('site_id', Glob.anchor_site.id, type=int)
+    after = history_key(request.args.get('after', ''))
+    stream = request.args.get('stream', int(FlaskConfig.history_stream), type=int)
+    if request.method == 'POST' and form.validate_on_submit():
         log.debug(f'history - post: site_id={form.site_id.data}')
         site_id = int(form.site_id.data)
+        after = None
+    else:
+        log.debug(f'history - get: site_id={site_id}')
+    form.site_id.data = site_id
+    dark = session.get('theme') == 'dark'
+    if stream:
         site_events = get_site_events(site_id)
-    return render_template('history.html', dark=session.get('theme') == 'dark', site_events=site_events, form=form)
+        return Response(stream_with_context(buffered(stream_template(
+            'history.html', dark=dark, site_events=site_events, form=form, site_id=site_id, next_key=None))))
+    site_events = list(get_site_events(site_id, after=after, limit=FlaskConfig.history_page_size))
+    keys = [event['key'] for event in site_events if not event['is_date']]
+    next_key = keys[-1] if len(keys) == FlaskConfig.history_page_size else None
+    return render_template('history.html', dark=dark, site_events=site_events, form=form, site_id=site_id,
+                           next_key=next_key)
 
 
 def boat_choices():
@@ -481,26 +660,20 @@ def config_app():
     if request.method == 'GET':
         form.process(obj=Glob.app_config)
     elif form.validate_on_submit():
-        form.populate_obj(Glob.app_config)
-        Glob.cpu_temp_monitor = Glob.app_config.cpu_temp_monitor
-        Glob.tz_hour_adjust = Glob.app_config.tz_hour_adjust
-        Glob.cpu_temp_target = Glob.app_config.cpu_temp_target
-        Glob.cpu_temp_high = Glob.app_config.cpu_temp_high
-        add_boat = Glob.app_config.boat_id < 0
+        app_config = Glob.app_config_record()
+        form.populate_obj(app_config)
+        add_boat = app_config.boat_id < 0
         if add_boat:
-            Glob.boat_config = ConfigBoat()
-            Glob.boat_config.time_stamp = Glob.ts_adjusted()
-            db.session.add(Glob.boat_config)
-            db.session.commit()
-            Glob.app_config.boat_id = Glob.boat_config.id
+            boat_config = ConfigBoat()
+            boat_config.time_stamp = Glob.ts_adjusted()
+            Glob.save_master(boat_config)
+            app_config.boat_id = boat_config.id
+        app_config.time_stamp = Glob.ts_adjusted()
+        Glob.save_master(app_config)
+        Glob.load_master_db_records()
         if not Glob.cpu_temp_monitor:
             if relay is not None and relay.connected:
                 relay.rpi_fan_switch.off()
-        Glob.app_config.time_stamp = Glob.ts_adjusted()
-        db.session.add(Glob.app_config)
-        db.session.commit()
-
-        Glob.boat_config = ConfigBoat.query.get_or_404(Glob.app_config.boat_id)
         set_windlass_param()
         if add_boat:
             flash(f'New boat added with default settings', 'success')
@@ -521,19 +694,15 @@ def config_boat():
     form = ConfigBoatForm()
     if request.method == 'GET':
         Glob.load_master_db_records()
-        if not ConfigBoat.query.filter(ConfigBoat.id == Glob.app_config.boat_id).first():
-            db.session.add(Glob.boat_config)
-            db.session.commit()
-        Glob.boat_config = ConfigBoat.query.get_or_404(Glob.app_config.boat_id)
         form.process(obj=Glob.boat_config)
     elif form.validate_on_submit():
         isnew = False
-        Glob.boat_config = ConfigBoat.query.get_or_404(Glob.app_config.boat_id)
-        form.populate_obj(Glob.boat_config)
-        Glob.boat_config.id = int(Glob.boat_config.id)
-        Glob.boat_config.time_stamp = Glob.ts_adjusted()
-        db.session.add(Glob.boat_config)
-        db.session.commit()
+        boat_config = ConfigBoat.query.get_or_404(Glob.app_config.boat_id)
+        form.populate_obj(boat_config)
+        boat_config.id = int(boat_config.id)
+        boat_config.time_stamp = Glob.ts_adjusted()
+        Glob.save_master(boat_config)
+        Glob.load_master_db_records()
         msg = f'Boat config {Glob.boat_config.boat_name} was {"created" if isnew else "updated"}'
         log.info(msg)
         flash(msg, 'success')
@@ -542,6 +711,38 @@ def config_boat():
     return render_template('config_boat.html', dark=session.get('theme') == 'dark', form=form)
 
 
+@main.route('/calibrate', methods=['GET', 'POST'])
+def calibrate():
+    """ Show the anchor speeds fitted from the corrected runs and apply them to the boat settings """
+    log.debug('calibrate - get')
+    set_visitor_control()
+    if not in_control():
+        return redirect(url_for('main.control', action='info'))
+    journal.flush()
+    Glob.load_master_db_records()
+    fitted = fit_speeds(Glob.app_config.boat_id)
+    form = CalibrateForm()
+    if form.validate_on_submit():
+        boat_config = Glob.boat_config_record()
+        changed = []
+        for name in ('down', 'up'):
+            if fitted[name]['speed'] is not None:
+                setattr(boat_config, f'{name}_speed', fitted[name]['speed'])
+                changed.append(f'{name} {fitted[name]["speed"]} m/min')
+        if changed:
+            boat_config.time_stamp = Glob.ts_adjusted()
+            Glob.save_master(boat_config)
+            Glob.load_master_db_records()
+            set_windlass_param()
+            write_event(Action.BOAT_SETTINGS)
+            msg = f'Anchor speeds calibrated: {", ".join(changed)}'
+            log.info(msg)
+            flash(msg, 'success')
+        return redirect(url_for('main.config_boat'))
+    return render_template('calibrate.html', dark=session.get('theme') == 'dark', form=form, fitted=fitted,
+                           boat_config=Glob.boat_config)
+
+
 @main.route('/theme')
 def theme():
     log.debug('theme - get')
@@ -570,11 +771,13 @@ def quit_confirm():
 @main.route('/quit')
 def quit_app():
     """ Stop Windlass thread and initiate system shutdown in 60 secs when running on Raspberri Pi """
-    pauze_anchor_action()
+    if in_control():
+        pauze_anchor_action()
     if Glob.windlass.anchor_is_almost_up():
         Glob.windlass.actual_length = 0.0
         save_site_actual_length()
     write_event(Action.QUIT)
+    journal.flush()
     if Glob.windlass_running:
         Glob.windlass.quit_listener()
     if platform.node() == FlaskConfig.prod_server:
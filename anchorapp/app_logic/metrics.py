@@ -0,0 +1,226 @@
+""" Metrics in the Prometheus text format: per-route latency histograms, database query count and commit time
+    per request, the commit time of the background writers, and gauges of the application state. The histograms have fixed buckets to keep the memory use constant. """
+
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from flask import Blueprint, Response, request, g
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .. import db, log
+from .util import Glob, cpu_temperature
+from .thermal import thermal_controller
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)   # seconds
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)                                     # queries per request
+PAUSE_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1)           # seconds
+ARRIVAL_KEY = 'anchorapp.arrival'   # WSGI environ key of the perf_counter time the request arrived
+
+
+class Histogram:
+    """ Counts of observed values per bucket, plus the count and sum of all values """
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last one is the +Inf bucket
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def lines(self, name: str, labels: str = '') -> list:
+        """ Sample lines with the cumulative bucket counts """
+        sep = ',' if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        labels = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{labels} {round(self.sum, 6)}')
+        lines.append(f'{name}_count{labels} {self.count}')
+        return lines
+
+
+class Metrics:
+    """ Registry of the application metrics """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.route_latency = dict()                  # endpoint: Histogram of the request duration
+        self.request_queries = Histogram(QUERY_BUCKETS)
+        self.request_commit_time = Histogram(LATENCY_BUCKETS)      # total duration of the commits of a request
+        self.background_commit_time = Histogram(LATENCY_BUCKETS)   # each commit outside a request (journal)
+        self.pause_latency = Histogram(PAUSE_BUCKETS)
+        self.queries_total = 0
+        self.gauges = dict()                         # name: (help text, function returning the value)
+        self.local = threading.local()               # per thread: queries and commit time of the request
+
+    def __repr__(self):
+        return f'Metrics(routes={len(self.route_latency)}, queries_total={self.queries_total})'
+
+    def gauge(self, name: str, help_text: str, value_function):
+        """ Register a gauge, its value is read when the metrics are collected """
+        self.gauges[name] = (help_text, value_function)
+
+    def observe_request(self, endpoint: str, seconds: float, queries: int, commit_secs: float):
+        with self.lock:
+            if endpoint not in self.route_latency:
+                self.route_latency[endpoint] = Histogram(LATENCY_BUCKETS)
+            self.route_latency[endpoint].observe(seconds)
+            self.request_queries.observe(queries)
+            self.request_commit_time.observe(commit_secs)
+
+    def observe_pause(self, seconds: float):
+        with self.lock:
+            self.pause_latency.observe(seconds)
+
+    def on_query(self, *args):
+        with self.lock:
+            self.queries_total += 1
+        if getattr(self.local, 'queries', None) is not None:
+            self.local.queries += 1
+
+    def on_before_commit(self, session):
+        self.local.commit_start = perf_counter()
+
+    def on_after_commit(self, session):
+        start = getattr(self.local, 'commit_start', None)
+        if start is None:
+            return
+        self.local.commit_start = None
+        seconds = perf_counter() - start
+        if getattr(self.local, 'commit_secs', None) is not None:
+            self.local.commit_secs += seconds
+        else:
+            with self.lock:
+                self.background_commit_time.observe(seconds)
+
+    def listen(self, engine):
+        """ Count the queries of the engine and time the commits of all sessions """
+        event.listen(engine, 'before_cursor_execute', self.on_query)
+        event.listen(Session, 'before_commit', self.on_before_commit)
+        event.listen(Session, 'after_commit', self.on_after_commit)
+
+    def exposition(self) -> str:
+        """ All metrics in the Prometheus text format """
+        lines = ['# HELP anchorapp_request_duration_seconds Request duration per endpoint',
+                 '# TYPE anchorapp_request_duration_seconds histogram']
+        with self.lock:
+            for endpoint, histogram in sorted(self.route_latency.items()):
+                lines += histogram.lines('anchorapp_request_duration_seconds', f'endpoint="{endpoint}"')
+            lines += ['# HELP anchorapp_request_queries Database queries per request',
+                      '# TYPE anchorapp_request_queries histogram']
+            lines += self.request_queries.lines('anchorapp_request_queries')
+            lines += ['# HELP anchorapp_request_commit_seconds Commit time per request, including the flush',
+                      '# TYPE anchorapp_request_commit_seconds histogram']
+            lines += self.request_commit_time.lines('anchorapp_request_commit_seconds')
+            lines += ['# HELP anchorapp_background_commit_seconds Duration of the commits outside the requests, '
+                      'such as the batches of the event journal',
+                      '# TYPE anchorapp_background_commit_seconds histogram']
+            lines += self.background_commit_time.lines('anchorapp_background_commit_seconds')
+            lines += ['# HELP anchorapp_pause_relay_off_seconds Time from the arrival of a pause to relay off',
+                      '# TYPE anchorapp_pause_relay_off_seconds histogram']
+            lines += self.pause_latency.lines('anchorapp_pause_relay_off_seconds')
+            lines += ['# HELP anchorapp_db_queries_total Database queries executed',
+                      '# TYPE anchorapp_db_queries_total counter',
+                      f'anchorapp_db_queries_total {self.queries_total}']
+        for name, (help_text, value_function) in self.gauges.items():
+            try:
+                value = float(value_function())
+            except (TypeError, ValueError) as err:
+                log.debug(f'metrics.exposition - gauge {name} not available: {err}')
+                continue
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+registry = Metrics()   # instantiate (singleton) here to make it available to other modules
+registry.gauge('anchorapp_windlass_running', 'Windlass relay switched on', lambda: Glob.windlass.running)
+registry.gauge('anchorapp_windlass_paused', 'Windlass paused', lambda: Glob.windlass.paused)
+registry.gauge('anchorapp_windlass_direction', 'Windlass direction: 1 down, -1 up, 0 idle',
+               lambda: Glob.windlass.direction)
+registry.gauge('anchorapp_windlass_actual_length_meters', 'Actual chain length', lambda: Glob.windlass.actual_length)
+registry.gauge('anchorapp_windlass_target_length_meters', 'Target chain length', lambda: Glob.windlass.target_length)
+registry.gauge('anchorapp_cpu_temperature_celsius', 'CPU temperature', cpu_temperature)
+registry.gauge('anchorapp_fan_on', 'Fan requested by the thermal controller', lambda: thermal_controller.fan_on)
+registry.gauge('anchorapp_cpu_throttle_events', 'CPU throttle events since start',
+               lambda: thermal_controller.throttle_count)
+
+metrics = Blueprint('metrics', __name__)
+
+
+@metrics.record_once
+def listen_engine(state):
+    with state.app.app_context():
+        registry.listen(db.engine)
+
+
+@metrics.record_once
+def stamp_arrival(state):
+    """ Record the arrival time of each request in its environ, before Flask handles it """
+    wsgi_app = state.app.wsgi_app
+
+    def stamped_wsgi_app(environ, start_response):
+        environ[ARRIVAL_KEY] = perf_counter()
+        return wsgi_app(environ, start_response)
+
+    state.app.wsgi_app = stamped_wsgi_app
+
+
+@metrics.before_app_request
+def start_request():
+    g.metrics_start = perf_counter()
+    registry.local.queries = 0
+    registry.local.commit_secs = 0.0
+
+
+class FirstByteTimer:
+    """ Body of a streamed response, records the request duration when the first chunk has been produced """
+
+    def __init__(self, body, endpoint: str, start: float, queries: int, commit_secs: float):
+        self.body = body
+        self.endpoint = endpoint
+        self.start = start
+        self.queries = queries
+        self.commit_secs = commit_secs
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.observe()
+            yield chunk
+        self.observe()                   # empty body
+
+    def observe(self):
+        if self.start is not None:
+            registry.observe_request(self.endpoint, perf_counter() - self.start, self.queries, self.commit_secs)
+            self.start = None
+
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
+
+
+@metrics.after_app_request
+def end_request(response):
+    """ Record the duration until the response is returned. The body of a streamed response is produced later,
+        it is wrapped to record the time to the first byte instead. """
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        endpoint = request.endpoint or 'unmatched'
+        local = registry.local
+        if response.is_streamed:
+            response.response = FirstByteTimer(response.response, endpoint, start, local.queries, local.commit_secs)
+        else:
+            registry.observe_request(endpoint, perf_counter() - start, local.queries, local.commit_secs)
+    registry.local.queries = None
+    registry.local.commit_secs = None
+    return response
+
+
+@metrics.route('/metrics')
+def metrics_text():
+    return Response(registry.exposition(), mimetype='text/plain; version=0.0.4')
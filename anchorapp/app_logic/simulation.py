@@ -0,0 +1,77 @@
+""" Accelerated simulation of anchoring scenarios. A WindLass runs on a virtual clock with mock relay pins, in the
+    calling thread, so minutes of windlass runs take milliseconds and the results are deterministic.
+    A scenario is a sequence of (action, value) steps:
+        ('target', 40)        set the target length to n meters
+        ('run', None)         run or resume to the target length
+        ('pause_at', 60)      pause the run n seconds from now
+        ('down', 2)           go down n meters
+        ('up', 2)             go up n meters
+        ('anchor_up', None)   pull up to the minimum length
+        ('wait', 30)          let n seconds pass """
+
+from .. import log
+from .windlass import WindLass, VirtualClock, Relay
+
+DEFAULT_SCENARIO = (('target', 40), ('pause_at', 60), ('run', None), ('wait', 30), ('run', None),
+                    ('up', 2), ('down', 1), ('anchor_up', None))
+
+
+class Simulation:
+    """ WindLass with a virtual clock and its own mock relay board, driven step by step """
+
+    def __init__(self, chain_length=50, min_length_up=5, down_speed=15.0, up_speed=12.0):
+        self.clock = VirtualClock()
+        self.windlass = WindLass(chain_length, min_length_up, down_speed, up_speed, clock=self.clock,
+                                 relay_board=Relay(mock=True))
+
+    def __repr__(self):
+        return f'Simulation({self.clock!r}, {self.windlass!r})'
+
+    def step(self, action: str, value: float = None) -> dict:
+        """ Perform one step and apply the resulting commands, return the state after the step """
+        windlass = self.windlass
+        relay_on_secs = windlass.relay_on_secs
+        if action == 'target':
+            windlass.target_length = value
+        elif action == 'run':
+            windlass.resume()
+        elif action == 'pause_at':
+            self.clock.schedule(value, windlass.pause)
+        elif action == 'down':
+            windlass.go_down(meters=value)
+        elif action == 'up':
+            windlass.go_up(meters=value)
+        elif action == 'anchor_up':
+            windlass.target_length = windlass.min_length_up
+            windlass.resume()
+        elif action == 'wait':
+            self.clock.advance(value)
+        else:
+            raise ValueError(f'Unknown simulation action "{action}"')
+        windlass.apply_pending()
+        if windlass.signal_completed:   # as the home page does after a run
+            windlass.signal_completed = False
+            windlass.reset_manual_run()
+        return {'action': action, 'value': value, 'time': round(self.clock.now(), 3),
+                'actual_length': windlass.actual_length, 'target_length': windlass.target_length,
+                'relay_on_secs': round(windlass.relay_on_secs - relay_on_secs, 3), 'rejected': windlass.reject_msg}
+
+    def close(self):
+        self.windlass.relay.disconnect()
+
+
+def run_scenario(steps=DEFAULT_SCENARIO, **boat) -> dict:
+    """ Run the steps on a new simulation, boat takes the WindLass parameters chain_length, min_length_up,
+        down_speed and up_speed. Returns the state after each step and the final lengths and relay on time. """
+    simulation = Simulation(**boat)
+    try:
+        reports = [simulation.step(*step) for step in steps]
+    finally:
+        simulation.close()
+    windlass = simulation.windlass
+    result = {'steps': reports,
+              'final': {'actual_length': windlass.actual_length, 'target_length': windlass.target_length,
+                        'relay_on_secs': round(windlass.relay_on_secs, 3),
+                        'simulated_secs': round(simulation.clock.now(), 3)}}
+    log.debug(f"simulation.run_scenario - {len(reports)} steps: {result['final']}")
+    return result
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+from time import sleep
+from queue import Queue, Empty, Full
+from .. import log
+
+
+class Subscriber:
+    """ Bounded message queue of one connected client """
+
+    def __init__(self, max_size=10):
+        self.queue = Queue(maxsize=max_size)
+
+    def put(self, message: str | None):
+        """ Add a message, drop the oldest message when the client does not keep up """
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except Full:
+                try:
+                    self.queue.get_nowait()
+                except Empty:
+                    pass
+
+    def get(self, timeout: float) -> str | None:
+        """ Wait for the next message, raises queue.Empty after timeout seconds """
+        return self.queue.get(timeout=timeout)
+
+
+class AsyncSubscriber:
+    """ Bounded message queue of one client served on an asyncio event loop """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_size=10):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_size)
+
+    def put(self, message: str | None):
+        """ Add a message from any thread, it is handed over to the event loop """
+        self.loop.call_soon_threadsafe(self.put_nowait, message)
+
+    def put_nowait(self, message: str | None):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout: float) -> str | None:
+        """ Wait for the next message, raises TimeoutError after timeout seconds """
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class StreamHub:
+    """ Broadcast of server sent events. A single publisher thread samples the state once per tick
+        and pushes only changed values into the queues of the subscribers. The publisher only runs
+        while there are subscribers. The sample function returns the data value as a string,
+        or None when the stream must be closed. """
+
+    def __init__(self, sample, tick_secs=0.1, heartbeat_secs=15.0, max_queue=10):
+        self.sample = sample                     # function returning the current data value
+        self.tick_secs = tick_secs               # sample interval of the publisher
+        self.heartbeat_secs = heartbeat_secs     # send a comment line to an idle client after n seconds
+        self.max_queue = max_queue               # max messages waiting per subscriber
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.last_value = None
+        self.publisher = None                    # thread running the publisher
+
+    def __repr__(self):
+        return f'StreamHub(subscribers={self.subscriber_count})'
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self.subscribers)
+
+    def subscribe(self, subscriber=None) -> Subscriber:
+        """ Add a subscriber, which receives the current value right away """
+        if subscriber is None:
+            subscriber = Subscriber(self.max_queue)
+        value = self.sample()
+        subscriber.put(value)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            if self.publisher is None:
+                self.last_value = value
+                self.publisher = threading.Thread(target=self.run_publisher, daemon=True)
+                self.publisher.start()
+        log.debug(f'stream_hub.subscribe - {self.subscriber_count} subscriber(s)')
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+        log.debug(f'stream_hub.unsubscribe - {self.subscriber_count} subscriber(s)')
+
+    def publish(self, value: str | None):
+        """ Push a value to all subscribers """
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(value)
+
+    def run_publisher(self):
+        """ Sample the state once per tick until the last subscriber has gone """
+        log.debug('stream_hub.run_publisher - started')
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    self.publisher = None
+                    self.last_value = None
+                    break
+            value = self.sample()
+            if value != self.last_value:
+                self.last_value = value
+                self.publish(value)
+            sleep(self.tick_secs)
+        log.debug('stream_hub.run_publisher - finished')
+
+    def stream(self):
+        """ Generator of the event-stream lines for one client """
+        subscriber = self.subscribe()
+        try:
+            while True:
+                try:
+                    value = subscriber.get(timeout=self.heartbeat_secs)
+                except Empty:
+                    yield ': heartbeat\n\n'
+                    continue
+                if value is None:
+                    break
+                yield f'data: {value}\n\n'
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def values_async(self):
+        """ Asynchronous generator of the changed values for one client, to run on an event loop.
+            Generates an empty string after heartbeat_secs without a change. """
+        subscriber = self.subscribe(AsyncSubscriber(asyncio.get_running_loop(), self.max_queue))
+        try:
+            while True:
+                try:
+                    value = await subscriber.get(timeout=self.heartbeat_secs)
+                except (asyncio.TimeoutError, TimeoutError):
+                    yield ''
+                    continue
+                if value is None:
+                    break
+                yield value
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def stream_async(self):
+        """ Asynchronous generator of the event-stream lines for one client, to run on an event loop """
+        async for value in self.values_async():
+            yield f'data: {value}\n\n' if value else ': heartbeat\n\n'
@@ -0,0 +1,110 @@
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+from time import perf_counter, time
+
+HEADER = struct.Struct('<dI')      # wall-clock start time of the run (seconds since the epoch), number of samples
+SAMPLE = struct.Struct('<ffbb')    # seconds since start, actual length, direction, relay on
+
+
+class RunTelemetry:
+    """ Samples of one windlass run in a preallocated ring buffer: the samples are stored in typed arrays of
+        a fixed capacity, so recording a sample does not allocate memory. When a run takes more samples
+        than the capacity, the oldest samples are overwritten. The packed samples of the last max_completed runs
+        are kept by run number until they are taken to be persisted with the event of the run. """
+
+    def __init__(self, capacity=2048, max_completed=8):
+        self.capacity = capacity
+        self.max_completed = max_completed
+        self.times = array('f', bytes(4 * capacity))        # seconds since the start of the run
+        self.lengths = array('f', bytes(4 * capacity))      # actual chain length in meters
+        self.directions = array('b', bytes(capacity))       # 1 = down, -1 = up
+        self.relay_on = array('b', bytes(capacity))         # 1 = relay switched on
+        self.count = 0                                      # samples recorded in the current run
+        self.start_time = 0.0                               # clock time at the start of the run
+        self.started_at = 0.0                               # wall-clock time at the start of the run
+        self.run = None                                     # number of the current run
+        self.running = False
+        self.completed = OrderedDict()                      # run number: packed samples, oldest run first
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f'RunTelemetry(samples={len(self)}, running={self.running})'
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def dropped(self) -> int:
+        """ Number of samples overwritten in the current run """
+        return max(0, self.count - self.capacity)
+
+    def start(self, start_time: float = None, run: int = None):
+        """ Start recording a new run, start_time is the clock time of the start """
+        with self.lock:
+            self.count = 0
+            self.start_time = perf_counter() if start_time is None else start_time
+            self.started_at = time()
+            self.run = run
+            self.running = True
+
+    def record(self, now: float, length: float, direction: int, relay_on: bool):
+        """ Store one sample, now is the clock time of the sample """
+        with self.lock:
+            i = self.count % self.capacity
+            self.times[i] = now - self.start_time
+            self.lengths[i] = length
+            self.directions[i] = direction
+            self.relay_on[i] = relay_on
+            self.count += 1
+
+    def finish(self):
+        """ End the run and keep its samples packed by run number, ready to be persisted """
+        with self.lock:
+            self.running = False
+            self.completed[self.run] = self.pack()
+            if len(self.completed) > self.max_completed:
+                self.completed.popitem(last=False)
+
+    def take_blob(self, run: int = None) -> bytes | None:
+        """ Packed samples of the completed run with this number, only returned once """
+        with self.lock:
+            return self.completed.pop(run, None)
+
+    def indexes(self) -> range:
+        """ Buffer positions of the samples, oldest first """
+        first = self.count - len(self)
+        return range(first, self.count)
+
+    def pack(self) -> bytes:
+        """ Samples of the run as a compact binary blob """
+        blob = bytearray(HEADER.size + len(self) * SAMPLE.size)
+        HEADER.pack_into(blob, 0, self.started_at, len(self))
+        offset = HEADER.size
+        for n in self.indexes():
+            i = n % self.capacity
+            SAMPLE.pack_into(blob, offset, self.times[i], self.lengths[i], self.directions[i], self.relay_on[i])
+            offset += SAMPLE.size
+        return bytes(blob)
+
+    def as_dict(self) -> dict:
+        """ Samples of the current or last run, for a JSON response """
+        with self.lock:
+            samples = [sample_dict(self.times[n % self.capacity], self.lengths[n % self.capacity],
+                                   self.directions[n % self.capacity], self.relay_on[n % self.capacity])
+                       for n in self.indexes()]
+            return {'running': self.running, 'start_time': self.started_at, 'dropped': self.dropped,
+                    'samples': samples}
+
+
+def sample_dict(secs: float, length: float, direction: int, relay_on: int) -> dict:
+    return {'t': round(secs, 3), 'length': round(length, 3), 'direction': direction, 'relay_on': bool(relay_on)}
+
+
+def unpack(blob: bytes) -> dict:
+    """ Samples of a blob created by RunTelemetry.pack """
+    start_time, count = HEADER.unpack_from(blob, 0)
+    end = HEADER.size + count * SAMPLE.size
+    samples = [sample_dict(*values) for values in SAMPLE.iter_unpack(blob[HEADER.size: end])]
+    return {'start_time': start_time, 'samples': samples}
@@ -0,0 +1,227 @@
+""" CPU temperature sensors. On the Raspberry Pi the temperature is read from the sysfs thermal zone via a file
+    descriptor which is kept open, vcgencmd is only used when the thermal zone is missing. Development machines
+    use a fake sensor. Readings are cached for a short time, so concurrent readers share one sample. """
+
+import os
+import platform
+import threading
+import subprocess
+from array import array
+from collections import deque
+from datetime import datetime
+from statistics import linear_regression, StatisticsError
+from time import monotonic
+from .. import log
+from ..flaskconfig import FlaskConfig
+
+
+class TemperatureSensor:
+    """ Base class of the sensors: read returns degrees Celsius or -1.0 when the temperature is not available """
+    name = 'none'
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}()'
+
+    def read(self) -> float:
+        return -1.0
+
+    def close(self):
+        pass
+
+
+class SysfsSensor(TemperatureSensor):
+    """ Kernel thermal zone, the file contains the temperature in millidegrees Celsius """
+    name = 'sysfs'
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = None
+
+    def __repr__(self):
+        return f'SysfsSensor({self.path})'
+
+    def read(self) -> float:
+        try:
+            if self.fd is None:
+                self.fd = os.open(self.path, os.O_RDONLY)
+            return int(os.pread(self.fd, 16, 0)) / 1000
+        except (OSError, ValueError) as err:
+            log.error(f'thermal.SysfsSensor - {self.path}: {err}')
+            self.close()
+            return -1.0
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class VcgencmdSensor(TemperatureSensor):
+    """ Raspberry Pi firmware command, output like temp=48.3'C """
+    name = 'vcgencmd'
+
+    def read(self) -> float:
+        try:
+            output_text = subprocess.run(['vcgencmd', 'measure_temp'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                         check=True).stdout.decode('utf-8')
+        except (OSError, subprocess.CalledProcessError) as err:
+            log.error(f"thermal.VcgencmdSensor - {err} {getattr(err, 'output', '')}")
+            return -1.0
+        start_p = output_text.find('temp=') + len('temp=')
+        end_p = output_text.find("'C")
+        try:
+            return float(output_text[start_p: end_p])
+        except ValueError:
+            log.error(f'thermal.VcgencmdSensor - unexpected output {output_text.strip()}')
+            return -1.0
+
+
+class FakeSensor(TemperatureSensor):
+    """ Fixed temperature for development machines, set temp_c to simulate a change """
+    name = 'fake'
+
+    def __init__(self, temp_c=60.0):
+        self.temp_c = temp_c
+
+    def __repr__(self):
+        return f'FakeSensor({self.temp_c})'
+
+    def read(self) -> float:
+        return self.temp_c
+
+
+class CachedSensor:
+    """ Reads the sensor at most once per max_age seconds """
+
+    def __init__(self, sensor: TemperatureSensor, max_age: float):
+        self.sensor = sensor
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.temp_c = None
+        self.read_time = 0.0     # monotonic time of the last reading
+
+    def __repr__(self):
+        return f'CachedSensor({self.sensor!r}, max_age={self.max_age})'
+
+    def read(self) -> float:
+        with self.lock:
+            now = monotonic()
+            if self.temp_c is None or now - self.read_time >= self.max_age:
+                self.temp_c = self.sensor.read()
+                self.read_time = now
+            return self.temp_c
+
+
+def read_throttled() -> int | None:
+    """ Throttle flags of the Raspberry Pi firmware, None when not available. Bit 2: throttled now,
+        bit 1: ARM frequency capped now, bit 3: soft temperature limit active now """
+    try:
+        with open(FlaskConfig.throttled_path) as file:
+            return int(file.read().strip(), 16)
+    except (OSError, ValueError):
+        return None
+
+
+class ThermalController:
+    """ Fan control on the predicted temperature. The readings are kept in a ring buffer, the rate of rise
+        is the least squares slope of the readings in the last trend_secs. The fan is switched on when the
+        temperature is predicted to reach the high limit within lookahead_secs, and off at the target
+        temperature when it is no longer rising. Throttling of the CPU is recorded as an event. """
+
+    def __init__(self, capacity=720, trend_secs=120.0, lookahead_secs=60.0, throttle_temp=80.0):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))     # monotonic time of the reading
+        self.temps = array('f', bytes(4 * capacity))     # degrees Celsius
+        self.count = 0
+        self.trend_secs = trend_secs
+        self.lookahead_secs = lookahead_secs
+        self.throttle_temp = throttle_temp               # assume throttling from this temperature without flags
+        self.fan_on = False
+        self.throttled = False
+        self.throttle_events = deque(maxlen=50)          # (datetime, temp_c, flags) of the last events
+        self.throttle_count = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f'ThermalController(readings={min(self.count, self.capacity)}, fan_on={self.fan_on})'
+
+    def record(self, now: float, temp_c: float):
+        with self.lock:
+            i = self.count % self.capacity
+            self.times[i] = now
+            self.temps[i] = temp_c
+            self.count += 1
+
+    def readings(self, since: float = None) -> list:
+        """ (monotonic time, temp_c) of the readings after since, oldest first """
+        with self.lock:
+            result = [(self.times[n % self.capacity], self.temps[n % self.capacity])
+                      for n in range(max(0, self.count - self.capacity), self.count)]
+        if since is not None:
+            result = [reading for reading in result if reading[0] > since]
+        return result
+
+    def slope(self, now: float) -> float:
+        """ Rate of rise in degrees per second over the last trend_secs, 0.0 when not enough readings """
+        readings = self.readings(since=now - self.trend_secs)
+        if len(readings) < 3:
+            return 0.0
+        try:
+            return linear_regression([t for t, _ in readings], [temp for _, temp in readings]).slope
+        except StatisticsError:
+            return 0.0
+
+    def update(self, now: float, temp_c: float, high: float, target: float, flags: int = None) -> bool:
+        """ Record a reading and return whether the fan must be on """
+        self.record(now, temp_c)
+        self.check_throttle(temp_c, flags)
+        slope = self.slope(now)
+        predicted = temp_c + slope * self.lookahead_secs
+        if not self.fan_on and (temp_c >= high or predicted >= high):
+            self.fan_on = True
+            log.debug(f'thermal.update - fan on at {round(temp_c, 1)}, rising {round(slope * 60, 2)} per minute, '
+                      f'predicted {round(predicted, 1)} with limit {high}')
+        elif self.fan_on and temp_c <= target and slope <= 0.0:
+            self.fan_on = False
+            log.debug(f'thermal.update - fan off at {round(temp_c, 1)} with target {target}')
+        return self.fan_on
+
+    def check_throttle(self, temp_c: float, flags: int | None):
+        throttled = bool(flags & 0xE) if flags is not None else temp_c >= self.throttle_temp
+        if throttled and not self.throttled:
+            self.throttle_events.append((datetime.now(), temp_c, flags))
+            self.throttle_count += 1
+            log.warning(f'thermal.check_throttle - CPU throttled at {temp_c} degrees, flags {flags}')
+        self.throttled = throttled
+
+    def as_dict(self, now: float) -> dict:
+        """ Readings and throttle events, for a JSON response """
+        return {'fan_on': self.fan_on, 'throttled': self.throttled, 'throttle_count': self.throttle_count,
+                'slope_per_min': round(self.slope(now) * 60, 3),
+                'readings': [{'age_secs': round(now - t, 1), 'temp_c': round(temp, 1)} for t, temp in self.readings()],
+                'throttle_events': [{'time': time.isoformat(timespec='seconds'), 'temp_c': temp, 'flags': flags}
+                                    for time, temp, flags in self.throttle_events]}
+
+
+def create_sensor(kind: str = 'auto') -> TemperatureSensor:
+    """ Sensor of the kind 'sysfs', 'vcgencmd' or 'fake'. With 'auto': the fake sensor on development machines,
+        on the Raspberry Pi the thermal zone when available, else vcgencmd. """
+    if kind == 'auto':
+        if platform.node() != FlaskConfig.prod_server:
+            kind = 'fake'
+        else:
+            kind = 'sysfs' if os.path.exists(FlaskConfig.thermal_zone_path) else 'vcgencmd'
+    if kind == 'sysfs':
+        sensor = SysfsSensor(FlaskConfig.thermal_zone_path)
+    elif kind == 'vcgencmd':
+        sensor = VcgencmdSensor()
+    else:
+        sensor = FakeSensor()
+    log.debug(f'thermal.create_sensor - {sensor!r}')
+    return sensor
+
+
+cpu_sensor = CachedSensor(create_sensor(FlaskConfig.thermal_sensor), FlaskConfig.thermal_cache_secs)
+thermal_controller = ThermalController(trend_secs=FlaskConfig.thermal_trend_secs,
+                                       lookahead_secs=FlaskConfig.thermal_lookahead_secs,
+                                       throttle_temp=FlaskConfig.thermal_throttle_temp)
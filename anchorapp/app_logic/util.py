@@ -1,25 +1,38 @@
 
-import platform
+import threading
+from collections import OrderedDict
 from datetime import date, datetime, timedelta
-from flask import request, flash
+from flask import request, flash, copy_current_request_context
 import subprocess
+from sqlalchemy.exc import IntegrityError
 from .. import db, log
-from ..flaskconfig import FlaskConfig
-from ..models.db_model import ConfigApp, ConfigBoat, Site, SiteEvent, User, Action
+from ..models.db_model import ConfigApp, ConfigBoat, Site, User, Action
 from .windlass import WindLass
+from .journal import journal, JournalEntry
+from .thermal import cpu_sensor
 
 
 class Glob:
-    """ Global variables, initialize with defaults and adjust later when the database has come online """
+    """ Global variables, initialize with defaults and adjust later when the database has come online.
+        The master-data records app_config, boat_config and anchor_site are read-only snapshots, which are
+        reloaded only when the generation was incremented by a write of one of these records. """
     initial_state = True
     new_target_set = True
     visitor_control = dict()           # visitor (IP address) has control rights True / False
-    app_config = ConfigApp(id=0)       # app config database record proxy
-    boat_config = ConfigBoat(id=0)     # boat config database record proxy
+    user_ids = OrderedDict()           # cached user id per visitor IP address, least recently used first
+    user_ids_max = 32                  # max number of cached user ids
+    user_lock = threading.Lock()       # guards user_ids
+    app_config = ConfigApp(id=0)       # app config snapshot
+    boat_config = ConfigBoat(id=0)     # boat config snapshot
     anchor_site = Site(id=0, refname='-', actual_length=0.0)
-    site_id = None                     # can always access, also when site is not a current db-record proxy
-    site_event = SiteEvent(id=0, site_id=0, action=0)
-    site_event_id = None               # can always access, also when site_event is not a current db-record proxy
+    site_id = None                     # id of the current site
+    generation = 0                     # incremented on every write of the app config, boat config or site
+    loaded_generation = -1             # generation of the loaded snapshots
+    run_events = OrderedDict()         # windlass run number: journal entry of the event which started the run
+    run_events_max = 8                 # max number of run events waiting for the completion of their run
+    recent_sites = None                # cached site_id: refname of recent sites, None when to be refreshed
+    recent_sites_time = 0.0            # monotonic time the recent sites were selected
+    recent_sites_max_age = 3600        # seconds, refresh to let old sites drop out of the period
     cpu_temp_monitor = False           # update from app_config, can always access
     tz_hour_adjust = 0                 # update from app_config, can always access
     cpu_temp_target = 45               # update from app_config, can always access
@@ -27,6 +40,8 @@ class Glob:
     windlass = WindLass(50, 5, 15, 12)
     windlass_running = None            # thread running the windlass logic
     temp_monitor_running = None        # thread running the CPU temperature monitor and fan trigger
+    ready_secs = None                  # seconds from start until warmed up, None while starting
+    pause_latency_ms = None            # last time from the arrival of a pause request until the relay was off
 
     @classmethod
     def ts_adjusted(cls):
@@ -36,24 +51,22 @@ class Glob:
     @classmethod
     def add_app_config(cls) -> bool:
         """ Add an app config record with ID 1 """
-        if ConfigApp.query.get(1) is not None:
+        if db.session.get(ConfigApp, 1) is not None:
             return False
-        cls.app_config = ConfigApp(id=1, boat_id=1)
-        db.session.add(cls.app_config)
-        db.session.commit()
+        db.session.add(ConfigApp(id=1, boat_id=1))
+        cls.save_master()
         log.info('Glob.add_default_app_config: created app config record')
         return True
 
     @classmethod
     def add_first_boat(cls) -> bool:
         """ Add the first boat with ID 1 """
-        first_boat = ConfigBoat.query.get(1)
+        first_boat = db.session.get(ConfigBoat, 1)
         if first_boat is not None:
             return False
-        cls.boat_config = ConfigBoat(id=1, boat_name='?', boat_draught=1.5, boat_length=10.0,
-                                     chain_length=50, down_speed=15, up_speed=12)
-        db.session.add(cls.boat_config)
-        db.session.commit()
+        db.session.add(ConfigBoat(id=1, boat_name='?', boat_draught=1.5, boat_length=10.0,
+                                  chain_length=50, down_speed=15, up_speed=12))
+        cls.save_master()
         log.info('Glob.add_first_boat: created first boat config record')
         flash(f'Review boat settings please', 'success')
         return True
@@ -61,52 +74,85 @@ class Glob:
     @classmethod
     def add_default_site(cls) -> bool:
         """ Add a default anchor site with ID 0 """
-        default_site = Site.query.get(0)
+        default_site = db.session.get(Site, 0)
         if default_site is not None:
             return False
-        cls.anchor_site = Site(id=0, user_id=get_user().id, refname='-', actual_length=0.0)
+        db.session.add(Site(id=0, user_id=get_user_id(), refname='-', actual_length=0.0))
         cls.site_id = 0
-        db.session.add(cls.anchor_site)
-        db.session.commit()
+        cls.save_master()
         log.info('Glob.add_default_site: created default site')
         return True
 
+    @classmethod
+    def master_records_exist(cls) -> bool:
+        """ The app config, its boat and the default site exist, the snapshots can be loaded without writing """
+        app_config = db.session.get(ConfigApp, 1)
+        if app_config is None or db.session.get(Site, 0) is None:
+            return False
+        if app_config.boat_id:
+            return db.session.get(ConfigBoat, app_config.boat_id) is not None
+        return cls.boat_config.get_last() is not None
+
+    @classmethod
+    def save_master(cls, *records):
+        """ Commit the (changed) master-data records and invalidate the snapshots """
+        for record in records:
+            db.session.add(record)
+        db.session.commit()
+        cls.generation += 1
+
     @classmethod
     def load_master_db_records(cls):
-        """ Get master-data records from the database, when not already loaded with the current records """
-        if not cls.app_config.is_current:
-            if ConfigApp.query.get(1) is None:
-                cls.add_app_config()
-            cls.app_config = ConfigApp.query.get(1)
-            cls.cpu_temp_monitor = cls.app_config.cpu_temp_monitor
-            cls.tz_hour_adjust = cls.app_config.tz_hour_adjust
-            cls.cpu_temp_target = cls.app_config.cpu_temp_target
-            cls.cpu_temp_high = cls.app_config.cpu_temp_high
-            # log.debug(f'load_db_records: set app_config to {cls.app_config}')
-        if cls.boat_config is None:
+        """ Load snapshots of the master-data records from the database, when the loaded snapshots are outdated """
+        if cls.loaded_generation == cls.generation:
+            return
+        generation = cls.generation
+        app_config = db.session.get(ConfigApp, 1)
+        if app_config is None:
+            cls.add_app_config()
+            app_config = db.session.get(ConfigApp, 1)
+        if app_config.boat_id:
+            boat_config = db.session.get(ConfigBoat, app_config.boat_id)
+        else:
+            boat_config = cls.boat_config.get_last()
+            log.debug(f'load_db_records: set boat_config to {boat_config} based on boat_config.get_last')
+        if boat_config is None:
             cls.add_first_boat()
-        if not cls.boat_config.is_current:
-            if cls.app_config.boat_id:
-                cls.boat_config = cls.boat_config.query.get(cls.app_config.boat_id)
-                # log.debug(f'load_db_records: set boat_config to {cls.boat_config} based on '
-                #           f'Glob.app_config.boat_id={cls.app_config.boat_id}')
-            else:
-                cls.boat_config = cls.boat_config.get_last()
-                log.debug(f'load_db_records: set boat_config to {cls.boat_config} based on boat_config.get_last')
-        if not cls.anchor_site.is_current:
-            if cls.site_id:
-                cls.anchor_site = cls.anchor_site.query.get(cls.site_id)
-                # log.debug(f'load_db_records: site set to {cls.anchor_site} based on Glob.site_id={cls.site_id}')
-            else:
-                if cls.app_config.site_id:
-                    cls.anchor_site = cls.anchor_site.query.get(cls.app_config.site_id)
-                    cls.site_id = cls.app_config.site_id
-                    log.debug(f'load_db_records: site set to {cls.anchor_site} based on app_config.site_id')
-                else:
-                    cls.add_default_site()
-                    cls.anchor_site = cls.anchor_site.get_last()
-                    cls.site_id = cls.anchor_site.id
-                    log.debug(f'load_db_records: site set to {cls.anchor_site} based on site.get_last')
+            boat_config = db.session.get(ConfigBoat, 1)
+        if cls.site_id:
+            anchor_site = db.session.get(Site, cls.site_id)
+        elif app_config.site_id:
+            anchor_site = db.session.get(Site, app_config.site_id)
+            log.debug(f'load_db_records: site set to {anchor_site} based on app_config.site_id')
+        else:
+            cls.add_default_site()
+            anchor_site = cls.anchor_site.get_last()
+            log.debug(f'load_db_records: site set to {anchor_site} based on site.get_last')
+        cls.app_config = app_config.snapshot()
+        cls.boat_config = boat_config.snapshot()
+        cls.anchor_site = anchor_site.snapshot()
+        cls.site_id = anchor_site.id
+        cls.cpu_temp_monitor = cls.app_config.cpu_temp_monitor
+        cls.tz_hour_adjust = cls.app_config.tz_hour_adjust
+        cls.cpu_temp_target = cls.app_config.cpu_temp_target
+        cls.cpu_temp_high = cls.app_config.cpu_temp_high
+        cls.loaded_generation = generation
+        log.debug(f'load_db_records: loaded generation {generation}')
+
+    @classmethod
+    def app_config_record(cls) -> ConfigApp:
+        """ App config database record, to update """
+        return db.session.get(ConfigApp, 1)
+
+    @classmethod
+    def boat_config_record(cls) -> ConfigBoat:
+        """ Boat config database record of the current boat, to update """
+        return db.session.get(ConfigBoat, cls.app_config.boat_id)
+
+    @classmethod
+    def anchor_site_record(cls) -> Site:
+        """ Current site database record, to update """
+        return db.session.get(Site, cls.anchor_site.id)
 
 
 def visitor_ip() -> str:
@@ -145,64 +191,114 @@ def get_user(ip_address='') -> User:
     if not user:
         user = User(user_ip=ip_address)
         user.username = f'user {ip_address}'
-        db.session.add(user)
-        db.session.commit()
-        log.info(f'get_user: added user {ip_address}')
+        try:
+            with db.session.begin_nested():   # on failure only the insert of the user is rolled back
+                db.session.add(user)
+            db.session.commit()
+            log.info(f'get_user: added user {ip_address}')
+        except IntegrityError:                # added meanwhile by another request
+            user = User.query.filter(User.user_ip == ip_address).one()
     return user
 
 
+def get_user_id(ip_address='') -> int:
+    """ Get the id of the user with ip_address (default the current visitor_ip) from the cache,
+        or via get_user when not cached. """
+    if not ip_address:
+        ip_address = visitor_ip()
+    user_id = cached_user_id(ip_address)
+    if user_id is not None:
+        return user_id
+    user_id = get_user(ip_address).id     # outside the lock, the other visitors do not wait for the database
+    with Glob.user_lock:
+        Glob.user_ids[ip_address] = user_id
+        if len(Glob.user_ids) > Glob.user_ids_max:
+            Glob.user_ids.popitem(last=False)
+    return user_id
+
+
+def cached_user_id(ip_address: str) -> int | None:
+    """ Id of the user with ip_address from the cache, None when not cached """
+    with Glob.user_lock:
+        user_id = Glob.user_ids.get(ip_address)
+        if user_id is not None:
+            Glob.user_ids.move_to_end(ip_address)
+        return user_id
+
+
 def is_number(txt: str) -> bool:
     """ Check if the string txt contains only digit characters, decimal dot or minus sign  """
     return len(txt) != 0 and txt.replace('-', '').replace('.', '').isnumeric()
 
 
-def write_event(action: Action):
-    """ Write a new SiteEvent to the database """
+def write_event(action: Action) -> JournalEntry | None:
+    """ Queue a new SiteEvent in the journal, which writes it to the database in the background """
     if action is None:
-        return
-    if not Glob.anchor_site.is_current:
-        Glob.load_master_db_records()
+        return None
+    Glob.load_master_db_records()
     length = Glob.app_config.manual_range if action.name == 'SET_MAN_RANGE' else Glob.windlass.actual_length
-    site_event = SiteEvent(
+    entry = journal.append(
         start_time=Glob.ts_adjusted(),
         end_time=Glob.ts_adjusted(),
         site_id=Glob.anchor_site.id,
         boat_id=Glob.app_config.boat_id,
-        user_id=get_user().id,
+        user_id=get_user_id(),
         action=action.value,
         target_length=Glob.windlass.target_length,
         start_actual_length=length)
-    db.session.add(site_event)
-    db.session.commit()
-    if action.is_anchor_run():
-        Glob.site_event = site_event
-        Glob.site_event_id = site_event.id
+    if Glob.recent_sites is not None and Glob.anchor_site.id not in Glob.recent_sites:
+        Glob.recent_sites = None
+    return entry
 
 
-def update_event():
-    """ Update the current event with the actual metrics """
-    if Glob.site_event is None:
-        log.warning('update_event: Glob.site_event is None')
-        return
-    if not Glob.anchor_site.is_current:
-        Glob.load_master_db_records()
-    if not Glob.site_event.is_current:
-        log.debug(f'update_event: reloading Glob.site_event with id={Glob.site_event_id}')
-        Glob.site_event = SiteEvent.query.get(Glob.site_event_id)
-    if Glob.site_event is None:
-        log.error('update_event: Glob.site_event is None')
+def write_pause_event() -> JournalEntry:
+    """ Queue the PAUSE event from the state in memory, without database access: the time and the length at
+        relay off. Without a cached user id the event gets the default user, see complete_pause_event. """
+    now = Glob.ts_adjusted()
+    values = dict(start_time=now, end_time=now, site_id=Glob.anchor_site.id, boat_id=Glob.app_config.boat_id,
+                  action=Action.PAUSE.value, target_length=Glob.windlass.target_length,
+                  start_actual_length=round(Glob.windlass.actual_length, 1))
+    user_id = cached_user_id(visitor_ip())
+    if user_id is not None:
+        values['user_id'] = user_id
+    return journal.append(**values)
+
+
+def complete_pause_event(entry: JournalEntry):
+    """ Set the user of a PAUSE event which was queued without it, after the response """
+    if 'user_id' not in entry.values:
+        journal.update(entry, user_id=get_user_id())
+
+
+def keep_run_event(entry: JournalEntry | None):
+    """ Keep the event of the windlass run which was posted last, to update it when that run has completed """
+    if entry is None:
         return
-    else:
-        Glob.site_event.end_time = Glob.ts_adjusted()
-        Glob.site_event.end_actual_length = Glob.windlass.actual_length
-        db.session.add(Glob.site_event)
-        db.session.commit()
+    Glob.run_events[Glob.windlass.run_number] = entry
+    if len(Glob.run_events) > Glob.run_events_max:
+        Glob.run_events.popitem(last=False)
+
+
+def update_event(run: int, length: float, ended: datetime) -> JournalEntry | None:
+    """ Update the event of a completed run with its end time and length and the telemetry of the run.
+        Returns the event, None when the event of the run is not known. """
+    entry = Glob.run_events.pop(run, None)
+    if entry is None:
+        log.warning(f'update_event: no event of run {run}')
+        return None
+    values = dict(end_time=ended + timedelta(hours=Glob.tz_hour_adjust), end_actual_length=length)
+    blob = Glob.windlass.telemetry.take_blob(run)
+    if blob is not None:
+        values['telemetry'] = blob
+    journal.update(entry, **values)
     # update pause event
-    pause_event = SiteEvent.query.get(Glob.site_event_id + 1)
-    if pause_event and Action(pause_event.action).name == 'PAUSE':
-        pause_event.start_actual_length = Glob.windlass.actual_length
-        db.session.add(pause_event)
-        db.session.commit()
+    journal.update_next(entry, Action.PAUSE, start_actual_length=length)
+    return entry
+
+
+def run_after_response(func):
+    """ Run func on a background thread in a copy of the current request context, the response does not wait """
+    threading.Thread(target=copy_current_request_context(func), daemon=True).start()
 
 
 def get_route(url: str):
@@ -274,24 +370,5 @@ def run_os_command(command_parts: list) -> tuple[str, str]:
 
 
 def cpu_temperature() -> float:
-    """ Get CPU temperature in degrees Celcius """
-    if platform.node() != FlaskConfig.prod_server:
-        return 60.0
-    command_parts = ['vcgencmd', 'measure_temp']
-    output_text, error_text = run_os_command(command_parts)
-    if output_text:
-        start_p = output_text.find('temp=') + len('temp=')
-        end_p = output_text.find("'C")
-        try:
-            temp_c = float(output_text[start_p: end_p])
-        except TypeError:
-            log.error(f'cpu_temperature: TypeError for {output_text}')
-            temp_c = 0.0
-        return temp_c
-
-    if error_text:
-        if output_text and output_text[-1:] == '\n':
-            output_text = output_text[:-1]
-        log.debug(f'cpu_temperature: {output_text}')
-        log.error(f'cpu_temperature: {error_text}')
-    return -1.0
+    """ Get CPU temperature in degrees Celcius, -1.0 when not available """
+    return cpu_sensor.read()
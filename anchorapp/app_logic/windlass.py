@@ -1,36 +1,50 @@
 
+import heapq
 import platform
+import threading
+from collections import deque
 from datetime import datetime
-from time import sleep
-from flask import flash
-from gpiozero import Device, DigitalOutputDevice
+from enum import Enum
+from time import perf_counter
 from .. import log
+from .telemetry import RunTelemetry
 from ..flaskconfig import FlaskConfig
-if platform.node() != FlaskConfig.prod_server:
-    from gpiozero.pins.mock import MockFactory
-    Device.pin_factory = MockFactory()
 
 
 class Relay:
     """ Connection to the Raspberri Relay board """
 
-    def __init__(self, channel1_pin=26, channel2_pin=20, channel3_pin=21):
+    def __init__(self, channel1_pin=26, channel2_pin=20, channel3_pin=21, mock=False):
         self. connected = False
+        self.mock = mock               # always use mock pins, also on the Raspberri Pi (for a simulation)
         self.channel1_pin = channel1_pin
         self.channel2_pin = channel2_pin
         self.channel3_pin = channel3_pin
         self.anchor_up_switch = None
         self.anchor_dn_switch = None
         self.rpi_fan_switch = None
+        self.lock = threading.Lock()   # the windlass and temperature monitor threads may connect at the same time
 
     def connect(self):
-        """ Connect to relay board """
-        if self.connected:
-            return
-        self.anchor_dn_switch = DigitalOutputDevice(self.channel1_pin, active_high=False, initial_value=False)
-        self.anchor_up_switch = DigitalOutputDevice(self.channel2_pin, active_high=False, initial_value=False)
-        self.rpi_fan_switch = DigitalOutputDevice(self.channel3_pin, active_high=False, initial_value=False)
-        self.connected = True
+        """ Connect to relay board. gpiozero is imported here, it is not needed to serve the first page """
+        with self.lock:
+            if self.connected:
+                return
+            from gpiozero import Device, DigitalOutputDevice
+            pin_factory = None
+            if self.mock:
+                from gpiozero.pins.mock import MockFactory
+                pin_factory = MockFactory()
+            elif platform.node() != FlaskConfig.prod_server and Device.pin_factory is None:
+                from gpiozero.pins.mock import MockFactory
+                Device.pin_factory = MockFactory()
+            self.anchor_dn_switch = DigitalOutputDevice(self.channel1_pin, active_high=False, initial_value=False,
+                                                        pin_factory=pin_factory)
+            self.anchor_up_switch = DigitalOutputDevice(self.channel2_pin, active_high=False, initial_value=False,
+                                                        pin_factory=pin_factory)
+            self.rpi_fan_switch = DigitalOutputDevice(self.channel3_pin, active_high=False, initial_value=False,
+                                                      pin_factory=pin_factory)
+            self.connected = True
 
     def disconnect(self):
         """ Disconnect from relay board """
@@ -48,14 +62,78 @@ class Relay:
 relay = Relay()  # instatiate (singleton) here to make it also available to other modules
 
 
+class Clock:
+    """ Real time for the windlass: perf_counter, and waiting on the condition variable of the windlass """
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}()'
+
+    def now(self) -> float:
+        return perf_counter()
+
+    def wait_for(self, condition: threading.Condition, predicate, timeout: float = None) -> bool:
+        """ Wait until predicate is true or timeout seconds have passed, call with the condition acquired """
+        return condition.wait_for(predicate, timeout=timeout)
+
+
+class VirtualClock(Clock):
+    """ Simulated time: a wait jumps ahead to its timeout at once, or to the first scheduled callback which makes
+        the predicate true. Use it in a single thread, without the listener thread: the callbacks stand in for
+        the user inputs which arrive while the windlass is running. """
+
+    def __init__(self, start: float = 0.0):
+        self.time = start
+        self.timers = list()             # heap of (time, sequence number, callback)
+        self.sequence = 0
+
+    def __repr__(self):
+        return f'VirtualClock(time={round(self.time, 3)}, timers={len(self.timers)})'
+
+    def now(self) -> float:
+        return self.time
+
+    def schedule(self, delay: float, callback):
+        """ Call callback when the time has advanced delay seconds """
+        self.sequence += 1
+        heapq.heappush(self.timers, (self.time + delay, self.sequence, callback))
+
+    def advance(self, secs: float):
+        """ Let secs pass, calling the scheduled callbacks which are due meanwhile """
+        self.wait_for(None, lambda: False, secs)
+
+    def wait_for(self, condition, predicate, timeout: float = None) -> bool:
+        end = None if timeout is None else self.time + timeout
+        while not predicate() and self.timers and (end is None or self.timers[0][0] <= end):
+            due, _, callback = heapq.heappop(self.timers)
+            self.time = max(self.time, due)
+            callback()
+        if predicate():
+            return True
+        if end is None:
+            raise RuntimeError('VirtualClock.wait_for - would wait forever, nothing scheduled')
+        self.time = max(self.time, end)
+        return False
+
+
+class Command(Enum):
+    """ Commands posted to the windlass control thread """
+    RUN = 1
+    PAUSE = 2
+    NUDGE_UP = 3
+    NUDGE_DOWN = 4
+    QUIT = 9
+
+
 class WindLass:
     """ To control the windlass. Runs the up or down button for a period of time estimated
         to arrive at the target chain length. While running up or down it will be blocking
         the process. Run it therefore in a separate thread or process when the main process should
-        still be responsive to user inputs."""
+        still be responsive to user inputs. The user inputs are posted as commands to the thread,
+        which blocks on a condition variable until a command arrives and then acts on it at once. """
 
-    def __init__(self, chain_length: int, min_length_up: int, down_speed: float, up_speed: float):
-        self.wait_secs = 0.2                     # wait time in listener event loop
+    def __init__(self, chain_length: int, min_length_up: int, down_speed: float, up_speed: float,
+                 clock: Clock = None, relay_board: Relay = None):
+        self.wait_secs = 0.2                     # update interval of the actual length while running
         self.threshold = 0.3                     # threshold to compare actual and target length (in meters)
         self.chain_length = chain_length         # anchor chain length
         self.target_length = 0                   # target deployed chain length
@@ -72,7 +150,21 @@ class WindLass:
         self.paused = True                       # run to target not yet started or interrupted
         self.direction = 0                       # 1 = down, -1 = up, 0 = idle
         self.signal_completed = False            # when action completed and client must be notified
+        self.completed_runs = deque(maxlen=8)    # (run number, actual length, end time) of the runs to be booked
         self.quit = False                        # to quit the event listener
+        self.condition = threading.Condition()   # guards the state changes and wakes up the listener
+        self.clock = clock or Clock()            # time source, a VirtualClock to simulate
+        self.relay = relay_board or relay        # relay board switched by the runs
+        self.commands = deque()                  # posted (command, clock time, run number) tuples
+        self.command_posted = None               # clock time of the command that started the current run
+        self.command_run = None                  # run number of that command, identifies the telemetry of the run
+        self.run_number = 0                      # number of the last posted run command
+        self.stopped_run = 0                     # runs up to this number were stopped by a pause, a resume
+                                                 # posts a new run and does not undo it
+        self.relay_latency_ms = None             # last measured run command to relay on time
+        self.reject_msg = ''                     # why the last go_up or go_down was ignored, to show to the user
+        self.telemetry = RunTelemetry()          # samples of the current or last run
+        self.relay_on_secs = 0.0                 # total time the up or down relay was switched on
         self.update_param(chain_length, min_length_up, down_speed, up_speed)
 
     def __repr__(self):
@@ -90,7 +182,18 @@ class WindLass:
     def status(self) -> dict:
         """ Current status as a dict """
         return {'target_length': self.target_length, 'actual_length': self.actual_length,
-                'running': self.running, 'paused': self.paused, 'direction': self.direction}
+                'running': self.running, 'paused': self.paused, 'direction': self.direction,
+                'relay_latency_ms': self.relay_latency_ms}
+
+    def post_command(self, command: Command):
+        """ Post a command to the control thread and wake it up, a run command gets the next run number """
+        with self.condition:
+            run = None
+            if command in (Command.RUN, Command.NUDGE_UP, Command.NUDGE_DOWN):
+                self.run_number += 1
+                run = self.run_number
+            self.commands.append((command, self.clock.now(), run))
+            self.condition.notify_all()
 
     def run_direction(self) -> int:
         """ Direction at the next run or continue command """
@@ -133,82 +236,107 @@ class WindLass:
         return msg
 
     def pause(self) -> bool:
-        """ Pause current up or down run """
-        if self.running:
+        """ Pause current up or down run, also a run which was posted and has not yet started """
+        with self.condition:
+            self.stopped_run = self.run_number
             self.paused = True
-            log.debug('windlass.pause - pauze start')
-            return True
-        else:
-            log.debug('windlass.pause - not running!')
-            return False
+            if self.running:
+                self.post_command(Command.PAUSE)
+                log.debug('windlass.pause - pauze start')
+                return True
+            else:
+                log.debug('windlass.pause - not running!')
+                return False
 
     def resume(self) -> bool:
         """ Resume after being paused """
-        if self.paused:
-            self.paused = False
-            self.reset_manual_run()
-            self.direction = self.run_direction()
-            self.prev_was_manual = False
-            log.debug(f'windlass.resume - resumed with direction {self.direction}')
-        return not self.paused
+        with self.condition:
+            if self.paused:
+                self.paused = False
+                self.reset_manual_run()
+                self.direction = self.run_direction()
+                self.prev_was_manual = False
+                self.post_command(Command.RUN)
+                log.debug(f'windlass.resume - resumed with direction {self.direction}')
+            return not self.paused
 
     def go_down(self, meters=0.0) -> bool:
-        """ Extend down for n meters """
+        """ Extend down for n meters, when ignored the reason is in reject_msg """
         status = False
+        self.reject_msg = ''
         if not meters:
             return status
-        if self.running:
-            log.warning(f'windlass.go_down requested but windlass is currently running, ignored')
-            flash('Already running, anchor-down ignored', category='warning')
-            return status
-        if self.actual_length >= (self.chain_length - 1):
-            log.warning(f'windlass.go_down requested but actual length is (almost) at max length, ignored')
-            flash(f'Already at max, anchor-down ignored', category='warning')
-            return status
-        if meters:
+        with self.condition:
+            if self.running:
+                log.warning(f'windlass.go_down requested but windlass is currently running, ignored')
+                self.reject_msg = 'Already running, anchor-down ignored'
+                return status
+            if self.actual_length >= (self.chain_length - 1):
+                log.warning(f'windlass.go_down requested but actual length is (almost) at max length, ignored')
+                self.reject_msg = 'Already at max, anchor-down ignored'
+                return status
             self.manual_up_target = 0.0
             self.manual_down_target = min(round(self.actual_length + meters, 1), self.chain_length)
-        self.direction = 1
-        self.paused = False
-        self.prev_was_manual = True
+            self.direction = 1
+            self.paused = False
+            self.prev_was_manual = True
+            self.post_command(Command.NUDGE_DOWN)
         status = True
         return status
 
     def go_up(self, meters=0.0) -> bool:
-        """ Pull up for n meters """
+        """ Pull up for n meters, when ignored the reason is in reject_msg """
         status = False
+        self.reject_msg = ''
         if not meters:
             return status
-        if self.running:
-            log.warning('windlass.go_up requested but windlass is currently running, ignored')
-            flash('Already running, anchor-up ignored', category='warning')
-            return status
-        if self.actual_length <= self.min_length_up:
-            log.warning(f'windlass.go_up requested but actual length is below {int(self.min_length_up)}m, ignored')
-            flash(f'Below {self.min_length_up}m, anchor-up ignored', category='warning')
-            return status
-        if meters:
+        with self.condition:
+            if self.running:
+                log.warning('windlass.go_up requested but windlass is currently running, ignored')
+                self.reject_msg = 'Already running, anchor-up ignored'
+                return status
+            if self.actual_length <= self.min_length_up:
+                log.warning(f'windlass.go_up requested but actual length is below {int(self.min_length_up)}m, '
+                            f'ignored')
+                self.reject_msg = f'Below {self.min_length_up}m, anchor-up ignored'
+                return status
             self.manual_down_target = 0.0
             self.manual_up_target = max(round(self.actual_length - meters, 1), self.min_length_up)
-        self.direction = -1
-        self.paused = False
-        self.prev_was_manual = True
+            self.direction = -1
+            self.paused = False
+            self.prev_was_manual = True
+            self.post_command(Command.NUDGE_UP)
         status = True
         return status
 
     def reset_manual_run(self):
-        self.manual_down_target = 0.0
-        self.manual_up_target = 0.0
+        with self.condition:
+            self.manual_down_target = 0.0
+            self.manual_up_target = 0.0
+
+    def current_target(self) -> float:
+        """ Target length of the current run: the manual target when going up or down for n meters """
+        if self.manual_down_target:
+            return self.manual_down_target
+        elif self.manual_up_target:
+            return self.manual_up_target
+        return self.target_length
+
+    def run_seconds(self, target: float) -> float:
+        """ Seconds to run in the current direction from the actual length to the target length """
+        speed_ms = self.up_speed_ms if self.direction == -1 else self.dn_speed_ms
+        distance = (target - self.actual_length) * self.direction
+        if distance <= 0 or speed_ms <= 0:
+            return 0.0
+        return distance / speed_ms
 
     def on_target(self) -> bool:
         """ Check of the actual chain length out is on the target length """
-        target = self.target_length
+        target = self.current_target()
         if self.manual_down_target:
             self.direction = 1
-            target = self.manual_down_target
         elif self.manual_up_target:
             self.direction = -1
-            target = self.manual_up_target
 
         if self.direction == 0:
             is_on_target = abs(round(self.actual_length - target, 1)) < self.threshold
@@ -245,12 +373,13 @@ class WindLass:
     def run_anchor(self):
         """ Excute an anchor action """
         solenoid_switch = None
-        if not relay.connected:
-            relay.connect()
+        run = self.command_run
+        if not self.relay.connected:
+            self.relay.connect()
         if self.direction == 1:
-            solenoid_switch = relay.anchor_dn_switch
+            solenoid_switch = self.relay.anchor_dn_switch
         elif self.direction == -1:
-            solenoid_switch = relay.anchor_up_switch
+            solenoid_switch = self.relay.anchor_up_switch
         log.debug(f'windlass.run_anchor direction={self.direction_msg()}')
         if self.direction == -1:
             log.debug(f'windlass.run_anchor up_speed={self.up_speed} m/min  up_speed_ms={self.up_speed_ms} m/sec')
@@ -258,32 +387,75 @@ class WindLass:
             log.debug(f'windlass.run_anchor dn_speed={self.dn_speed} m/min  dn_speed_ms={self.dn_speed_ms} m/sec')
 
         if self.direction != 0:
-            self.running = True
+            target = self.current_target()
+            speed_ms = self.up_speed_ms if self.direction == -1 else self.dn_speed_ms
+            start_length = self.actual_length
+            run_secs = self.run_seconds(target)
+            with self.condition:
+                self.running = True
             solenoid_switch.on()
-            prev_time_stamp = datetime.now()
-            while not self.paused and not self.on_target():
-                sleep(self.wait_secs)
-                time_stamp = datetime.now()
-                elapsed = time_stamp - prev_time_stamp
-                elapsed_seconds = elapsed.seconds + elapsed.microseconds / 1_000_000
-                if self.direction == -1:
-                    self.actual_length -= self.up_speed_ms * elapsed_seconds
-                elif self.direction == 1:
-                    self.actual_length += self.dn_speed_ms * elapsed_seconds
-                else:
-                    log.error(f'windlass.run_to_target running with direction={self.direction}, paused')
-                    self.paused = True
-                prev_time_stamp = time_stamp
+            start_time = self.clock.now()
+            stop_time = start_time + run_secs     # switch off at this instant, not at the next update
+            self.telemetry.start(start_time, self.command_run)
+            self.telemetry.record(start_time, start_length, self.direction, True)
+            self.log_relay_latency(self.command_posted)
+            log.debug(f'windlass.run_anchor scheduled stop after {round(run_secs, 3)} secs at {target}m')
+            while not self.is_stopped(run) and not self.quit:
+                now = self.clock.now()
+                if now >= stop_time:
+                    break
+                with self.condition:
+                    self.clock.wait_for(self.condition, lambda: self.is_stopped(run) or self.quit,
+                                        timeout=min(self.wait_secs, stop_time - now))
+                now = self.clock.now()
+                self.actual_length = start_length + self.direction * speed_ms * (now - start_time)
+                self.telemetry.record(now, self.actual_length, self.direction, True)
             solenoid_switch.off()
+            stop = self.clock.now()
+            on_secs = stop - start_time
+            self.relay_on_secs += on_secs
+            self.actual_length = start_length + self.direction * speed_ms * on_secs
+            self.telemetry.record(stop, self.actual_length, self.direction, False)
+            self.telemetry.finish()
+            if not self.is_stopped(run):      # a pause stops short of the target, no overshoot
+                overshoot_cm = (self.actual_length - target) * self.direction * 100
+                log.info(f'windlass.run_anchor stopped at {round(self.actual_length, 3)}m after '
+                         f'{round(on_secs, 3)} secs, overshoot {round(overshoot_cm, 1)} cm')
             self.actual_length = round(self.actual_length, 1)
+            self.completed_runs.append((run, self.actual_length, datetime.now()))
             self.signal_completed = True
             log.debug(f'windlass.run_anchor set signal_completed to True')
 
-        self.direction = 0
-        self.running = False
-        self.paused = True
+        with self.condition:
+            self.running = False
+            # stay unpaused when resumed meanwhile: a later run was posted after the pause
+            self.paused = run is None or self.run_number == run or self.is_stopped(self.run_number)
+            if self.paused:
+                self.direction = 0
         log.debug(f'on_target={self.on_target()}  {self.status_msg()}')
 
+    def is_busy(self) -> bool:
+        """ A run is going on, or was posted and has not yet started """
+        return self.running or not self.paused
+
+    def take_completed(self) -> list:
+        """ The (run number, actual length, end time) of the runs completed since the last call """
+        with self.condition:
+            completed = list(self.completed_runs)
+            self.completed_runs.clear()
+        return completed
+
+    def is_stopped(self, run: int | None) -> bool:
+        """ The run with this number was stopped by a pause """
+        return run is not None and run <= self.stopped_run
+
+    def log_relay_latency(self, posted: float | None):
+        """ Log the time from posting the run command until the relay was switched on """
+        if posted is None:
+            return
+        self.relay_latency_ms = round((self.clock.now() - posted) * 1000, 2)
+        log.debug(f'windlass.run_anchor relay on {self.relay_latency_ms} ms after command')
+
     def run_to_target(self):
         """ Run the windlass until the Actual chain length out is on the target length
             or the user instructs a pause, which will end the call. Call the method again to resume. """
@@ -297,6 +469,7 @@ class WindLass:
             self.paused = True
             self.direction = 0
             self.reset_manual_run()
+            self.completed_runs.append((self.command_run, self.actual_length, datetime.now()))
             if not self.signal_completed:
                 self.signal_completed = True
                 log.debug(f'windlass.run_to_target set signal_completed to True')
@@ -306,19 +479,48 @@ class WindLass:
 
     def quit_listener(self):
         log.debug(f'windlass.quit_listener')
-        self.quit = True
+        with self.condition:
+            self.quit = True
+            self.post_command(Command.QUIT)
+
+    def clear_commands(self):
+        """ Drop the commands left by a previous listener, such as its QUIT, call before starting a new one """
+        with self.condition:
+            self.commands.clear()
+
+    def apply_command(self, command: Command, posted: float, run: int = None):
+        """ Act on a command taken from the queue by the listener """
+        if command == Command.PAUSE:
+            log.debug('windlass.apply_command - pause, relay already switched off')
+            return
+        if self.paused or self.is_stopped(run):
+            log.debug(f'windlass.apply_command - {command.name} ignored, paused meanwhile')
+            return
+        self.command_posted = posted
+        self.command_run = run
+        if not self.on_target():
+            self.run_to_target()
+        else:
+            self.paused = True
+        self.command_posted = None
+        self.command_run = None
+
+    def apply_pending(self):
+        """ Apply the posted commands in the calling thread, to simulate without the listener thread """
+        while self.commands:
+            self.apply_command(*self.commands.popleft())
 
     def run_listener(self):
-        """ Run an event loop until the quit flag is set.
+        """ Run an event loop until the quit command is posted.
             Use this method when running the class in a
             separate process and keep it alive. """
         log.debug(f'windlass.run_listener - started')
-        while not self.quit:
-            if not self.paused:
-                if not self.on_target():
-                    self.run_to_target()
-                else:
-                    self.paused = True
-            sleep(self.wait_secs)
-        relay.disconnect()
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.commands or self.quit)
+                if self.quit:
+                    break
+                command = self.commands.popleft()
+            self.apply_command(*command)
+        self.relay.disconnect()
         log.debug(f'windlass.run_listener - finished')
@@ -0,0 +1,149 @@
+""" Asyncio serving mode: the long-lived event streams and the websocket command channel run as coroutines
+    on a single event loop, all other routes are passed on to the Flask app.
+    Requires the asgiref and uvicorn packages, and websockets for the command channel. """
+
+import json
+import asyncio
+from time import perf_counter
+from asgiref.wsgi import WsgiToAsgi
+from . import log
+from .app_logic import api
+from .app_logic.metrics import ARRIVAL_KEY
+from .app_logic.main import stream_hub, state_hub
+
+WEBSOCKET_PATH = '/ws'
+
+
+async def stream_actual(scope, receive, send):
+    """ Event stream of the actual chain length, served from the stream hub without a thread per client """
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache')]})
+
+    async def send_stream():
+        async for line in stream_hub.stream_async():
+            await send({'type': 'http.response.body', 'body': line.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    async def wait_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    tasks = {asyncio.create_task(send_stream()), asyncio.create_task(wait_disconnect())}
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+
+def scope_environ(scope) -> tuple[dict, dict]:
+    """ Client address and cookie of a websocket connection, for the Flask request context of its commands """
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+    environ_base = {'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '127.0.0.1'}
+    if 'x-forwarded-for' in headers:
+        environ_base['HTTP_X_FORWARDED_FOR'] = headers['x-forwarded-for']   # when behind a proxy
+    return environ_base, {'Cookie': headers['cookie']} if 'cookie' in headers else {}
+
+
+def run_command(flask_app, environ_base: dict, headers: dict, command: str) -> dict:
+    """ Handle a websocket command with the JSON API, in a request context of the client: 'status' or an action """
+    with flask_app.test_request_context(WEBSOCKET_PATH, environ_base=environ_base, headers=headers):
+        result = api.status() if command == 'status' else api.anchor(command)
+    state, status = result if isinstance(result, tuple) else (result, 200)
+    return {'ok': status == 200, 'state': state}
+
+
+async def websocket(scope, receive, send, flask_app):
+    """ Command channel of a control page. The client sends {"id": 1, "cmd": "pause"}, the reply
+        {"ack": 1, "ok": true, "state": {...}} follows once the command was handled. Changes of the windlass
+        state are pushed as {"push": {...}}. The command "ping" is acknowledged without a state. """
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+    environ_base, headers = scope_environ(scope)
+    log.debug(f"asgi.websocket - connected {environ_base['REMOTE_ADDR']}")
+    send_lock = asyncio.Lock()
+
+    async def send_text(text: str):
+        async with send_lock:
+            await send({'type': 'websocket.send', 'text': text})
+
+    async def push_state():
+        async for value in state_hub.values_async():
+            if value:
+                await send_text(f'{{"push": {value}}}')
+
+    async def handle_commands():
+        while True:
+            message = await receive()
+            arrival = perf_counter()
+            if message['type'] == 'websocket.disconnect':
+                return
+            try:
+                request = json.loads(message.get('text') or '')
+                command = str(request['cmd'])
+            except (ValueError, TypeError, KeyError):
+                await send_text(json.dumps({'ack': None, 'ok': False, 'error': 'Invalid command'}))
+                continue
+            if command == 'ping':            # the client checks the connection, no need for the Flask app
+                await send_text(json.dumps({'ack': request.get('id'), 'ok': True}))
+                continue
+            reply = await asyncio.to_thread(run_command, flask_app, environ_base | {ARRIVAL_KEY: arrival}, headers,
+                                            command)
+            await send_text(json.dumps({'ack': request.get('id')} | reply))
+
+    tasks = {asyncio.create_task(push_state()), asyncio.create_task(handle_commands())}
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    for task in done:
+        if task.exception() is not None:
+            log.debug(f'asgi.websocket - closed: {task.exception()!r}')
+    try:
+        await send({'type': 'websocket.close', 'code': 1000})
+    except (OSError, RuntimeError):   # the connection is gone already
+        pass
+    log.debug(f"asgi.websocket - disconnected {environ_base['REMOTE_ADDR']}")
+
+
+def create_asgi_app(flask_app):
+    """ ASGI application that serves the event streams and the websocket itself and the Flask blueprints
+        via a thread pool """
+    wsgi_app = WsgiToAsgi(flask_app)
+    async_routes = {'/stream_actual': stream_actual}
+    flask_app.jinja_env.globals['websocket_path'] = WEBSOCKET_PATH   # the control pages use the command channel
+
+    async def asgi_app(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] in async_routes:
+            await async_routes[scope['path']](scope, receive, send)
+        elif scope['type'] == 'websocket':
+            if scope['path'] == WEBSOCKET_PATH:
+                await websocket(scope, receive, send, flask_app)
+            else:
+                await send({'type': 'websocket.close', 'code': 1008})
+        elif scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        else:
+            await wsgi_app(scope, receive, send)
+
+    return asgi_app
+
+
+def serve_asgi(flask_app, host: str, port: int):
+    """ Run the ASGI application with uvicorn """
+    import uvicorn
+    from .server import notify_ready
+
+    class Server(uvicorn.Server):
+        async def startup(self, sockets=None):
+            await super().startup(sockets)
+            notify_ready()
+
+    log.info(f'serving in asgi mode on {host}:{port}')
+    Server(uvicorn.Config(create_asgi_app(flask_app), host=host, port=port, log_level='warning')).run()
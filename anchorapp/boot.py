@@ -0,0 +1,5 @@
+""" Start time of the process, imported first by the package to measure the time until the server is ready """
+
+from time import monotonic
+
+boot_started = monotonic()
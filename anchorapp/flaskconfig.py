@@ -1,9 +1,11 @@
 import platform
+from datetime import timedelta
 
 
 class FlaskConfig:
     SECRET_KEY = '--your-random-secret-key-used-in-CRSF-protection--'
     SQLALCHEMY_DATABASE_URI = 'sqlite:///anchorapp.db'
+    SQLALCHEMY_ENGINE_OPTIONS = {'pool_size': 8, 'max_overflow': 8, 'pool_timeout': 10, 'pool_recycle': 3600}
     SESSION_COOKIE_SECURE = False
     PERMANENT_SESSION_LIFETIME = timedelta(hours=48)
 
@@ -12,6 +14,49 @@ class FlaskConfig:
     db_dev_path = '/user-name/development-path/project-name'    # update to reflect your setup!
     db_prod_path = '/home/user-name'                            # update to reflect your setup!
 
+    # SQLite storage profile, applied to every new database connection
+    sqlite_pragmas = {
+        'journal_mode': 'WAL',          # readers do not block the writer and vice versa
+        'synchronous': 'NORMAL',        # with WAL: no fsync per commit, still safe against corruption
+        'mmap_size': 32 * 1024 * 1024,  # read the database file via memory mapping (bytes)
+        'cache_size': -4000,            # page cache per connection, negative value: in kB
+        'busy_timeout': 5000,           # wait up to n milliseconds for a lock instead of failing
+        'temp_store': 'MEMORY',
+    }
+
+    # Logging
+    log_file = None                     # path of a log file next to the console output, None: console only
+    log_file_max_bytes = 1024 * 1024    # rotate the log file at this size
+    log_file_backups = 5                # rotated log files to keep
+    log_debug_burst = 5                 # debug records per line of code passed within the interval below
+    log_debug_interval = 1.0            # seconds
+
+    # CPU temperature and fan control
+    thermal_sensor = 'auto'             # 'sysfs', 'vcgencmd', 'fake' or 'auto': fake when not on the prod_server
+    thermal_zone_path = '/sys/class/thermal/thermal_zone0/temp'
+    throttled_path = '/sys/devices/platform/soc/soc:firmware/get_throttled'
+    thermal_cache_secs = 2.0            # readers within n seconds share one reading
+    thermal_sample_secs = 5.0           # interval of the temperature monitor
+    thermal_trend_secs = 120.0          # rate of rise over the readings of the last n seconds
+    thermal_lookahead_secs = 60.0       # fan on when the high temperature is predicted within n seconds
+    thermal_throttle_temp = 80.0        # assume the CPU throttles from this temperature when no flags available
+
+    # Pause
+    pause_budget_ms = 20        # warn when the relay is switched off later than n ms after the pause request arrived
+
+    # History page
+    history_page_size = 100     # events per page
+    history_stream = False      # True: stream the complete history instead of paging
+
+    # Serving mode
+    server_mode = 'dev'     # 'dev': Flask development server, 'asgi': event streams on an asyncio event loop
+                            # 'wsgi': waitress production server with the thread pool settings below
+    server_port = 80        # port to listen on
+    wsgi_threads = 16                   # worker threads, note: every open event stream occupies one thread
+    wsgi_backlog = 64                   # pending connections queued by the operating system
+    wsgi_connection_limit = 64          # max open connections, others wait in the backlog
+    wsgi_channel_timeout = 120          # seconds before an idle keep-alive connection is closed
+
     @classmethod
     def sqlite_path_and_name(cls, path_only=False, as_info_message=False) -> str:
         """ SQLite database path & filename or info message """
@@ -1,7 +1,8 @@
 from enum import Enum
 from .. import db
 from datetime import datetime
-from sqlalchemy import select, func
+from sqlalchemy import select, func, event, text, inspect
+from .. import log
 
 
 class DbInfo:
@@ -22,6 +23,24 @@ class DbInfo:
         return (self.__dict__['_sa_instance_state'].has_identity and
                 self.__dict__['_sa_instance_state'].session is not None)
 
+    @property
+    def is_snapshot(self) -> bool:
+        """ Read-only copy of a record, see snapshot() """
+        return self.__dict__.get('_read_only', False)
+
+    def snapshot(self):
+        """ Read-only copy of the record with its column values. The copy is not part of a database session,
+            so reading it never queries the database, also not after a commit expired the original record. """
+        values = {attr.key: getattr(self, attr.key) for attr in inspect(type(self)).column_attrs}
+        copy = type(self)(**values)
+        copy.__dict__['_read_only'] = True
+        return copy
+
+    def __setattr__(self, key, value):
+        if self.__dict__.get('_read_only'):
+            raise AttributeError(f'{type(self).__name__} snapshot is read-only, update the database record instead')
+        super().__setattr__(key, value)
+
     def class_tbl_name(self):
         """ Derive the table name from the class name """
         cls_name = type(self).__name__
@@ -64,6 +83,7 @@ class ConfigApp(db.Model, DbInfo):
     manual_range = db.Column(db.Float, nullable=False, default=0.5, comment='Manual up / down range in meters')
     max_manual_range = db.Column(db.Integer, nullable=False, default=5, comment='Max manual up / down range in meters')
     tz_hour_adjust = db.Column(db.Integer, nullable=False, default=0, comment='Timezone hour adjustment')
+    cpu_temp_monitor = db.Column(db.Boolean, default=False, comment='Monitor CPU temperature and trigger the fan')
     cpu_temp_target = db.Column(db.Integer, default=50, comment='CPU temperature Celcius target to cool down to')
     cpu_temp_high = db.Column(db.Integer, default=60, comment='CPU temperature Celcius to trigger the fan')
 
@@ -129,6 +149,7 @@ class User(db.Model, DbInfo):
 
 class Site(db.Model, DbInfo):
     """ Anchor site, to relate arrival and leave events """
+    __table_args__ = (db.Index('ix_site_refname', 'refname'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), default=0, nullable=False)
     time_stamp = db.Column(db.DateTime, nullable=False, default=datetime.now)
@@ -183,6 +204,9 @@ class Action(Enum):
 
 class SiteEvent(db.Model, DbInfo):
     """ Log of events related to a site """
+    __table_args__ = (db.Index('ix_site_event_site_start', 'site_id', 'start_time'),
+                      db.Index('ix_site_event_start_site', 'start_time', 'site_id'),
+                      db.Index('ix_site_event_boat', 'boat_id'))
     id = db.Column(db.Integer, primary_key=True)
     boat_id = db.Column(db.Integer, db.ForeignKey('config_boat.id'), comment='Reference to boat')
     site_id = db.Column(db.Integer, db.ForeignKey('site.id'), nullable=False)
@@ -193,6 +217,7 @@ class SiteEvent(db.Model, DbInfo):
     target_length = db.Column(db.Float, comment='Target chain deployed length at start of action')
     start_actual_length = db.Column(db.Float, comment='Actual chain deployed length at start of action')
     end_actual_length = db.Column(db.Float, comment='Actual chain deployed length at end of action')
+    telemetry = db.Column(db.LargeBinary, comment='Packed samples of the windlass run, see app_logic.telemetry')
     # relationships
     boat = db.relationship('ConfigBoat', back_populates='events', lazy=True)
     site = db.relationship('Site', back_populates='events', lazy=True)
@@ -204,7 +229,38 @@ class SiteEvent(db.Model, DbInfo):
         super().__init__(**kwargs)
 
 
+class SchemaVersion(db.Model):
+    """ Applied database schema migrations """
+    version = db.Column(db.Integer, primary_key=True)
+    applied_on = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    description = db.Column(db.String(120))
+
+    def __repr__(self):
+        return f"SchemaVersion({self.version}, '{self.description}')"
+
+
 def create_database():
     """ (re) create database - deletes existing data! """
     #  db.drop_all()
     db.create_all()
+
+
+def set_storage_profile(engine, pragmas: dict):
+    """ Apply the SQLite pragmas to every new connection of the engine """
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):  # noqa
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def log_storage_profile(pragmas: dict):
+    """ Log the effective values of the SQLite pragmas and the connection pool """
+    with db.engine.connect() as conn:
+        effective = {name: conn.execute(text(f'PRAGMA {name}')).scalar() for name in pragmas}
+    settings = ' '.join(f'{name}={value}' for name, value in effective.items())
+    log.info(f'SQLite storage profile: {settings} pool={db.engine.pool.status()}')
+    for name, value in pragmas.items():
+        if isinstance(value, int) and effective[name] != value:
+            log.warning(f'SQLite pragma {name} is {effective[name]}, configured {value}')
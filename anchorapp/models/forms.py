@@ -74,8 +74,7 @@ class HomeForm(FlaskForm):
     submit = SubmitField('Adjust')
 
     def validate_target_length(self, target_id):  # noqa
-        if not Glob.boat_config.is_current:
-            Glob.load_master_db_records()
+        Glob.load_master_db_records()
         min_length = Glob.app_config.min_length_up
         max_length = Glob.boat_config.chain_length - Glob.app_config.min_length_up
         actual_length = self.actual_length.data
@@ -91,8 +90,7 @@ class HomeForm(FlaskForm):
             raise ValidationError(msg)
 
     def validate_actual_length(self, actual_id):  # noqa
-        if not Glob.boat_config.is_current:
-            Glob.load_master_db_records()
+        Glob.load_master_db_records()
         max_length = Glob.boat_config.chain_length
         actual_length = self.actual_length.data
         if max_length is None:
@@ -116,8 +114,7 @@ class TargetForm(FlaskForm):
     def validate_anchor_depth(self, depth_id):  # noqa
         anchor_depth_str = self.anchor_depth.data
         anchor_depth = float(anchor_depth_str) if is_number(anchor_depth_str) else 0.0
-        if not Glob.boat_config.is_current:
-            Glob.load_master_db_records()
+        Glob.load_master_db_records()
         min_anchor_depth = Glob.boat_config.min_anchor_depth()
         max_anchor_depth = Glob.boat_config.max_anchor_depth()
         if anchor_depth < min_anchor_depth or anchor_depth > max_anchor_depth:
@@ -132,3 +129,8 @@ class SiteSelectForm(FlaskForm):
     """ Select the anchor site """
     site_id = SelectField('Site', coerce=int)
     submit = SubmitField('Select')
+
+
+class CalibrateForm(FlaskForm):
+    """ Apply the calibrated anchor speeds to the boat settings """
+    submit = SubmitField('Apply')
@@ -0,0 +1,56 @@
+from sqlalchemy import inspect, select, func, text
+from .. import db, log
+from .db_model import SchemaVersion
+
+
+def create_index(name: str, table: str, columns: str):
+    """ Migration step: create an index when it does not exist yet """
+    def step(conn):
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'))
+    return step
+
+
+def add_column(table: str, column: str, column_type: str):
+    """ Migration step: add a column to an existing table when it does not exist yet """
+    def step(conn):
+        if column not in [col['name'] for col in inspect(conn).get_columns(table)]:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}'))
+    return step
+
+
+# (version, description, steps) in order of version: only add new versions at the end
+migrations = [
+    (1, 'Indexes on site_event and site', [
+        create_index('ix_site_event_site_start', 'site_event', 'site_id, start_time'),
+        create_index('ix_site_event_start_site', 'site_event', 'start_time, site_id'),
+        create_index('ix_site_event_boat', 'site_event', 'boat_id'),
+        create_index('ix_site_refname', 'site', 'refname'),
+    ]),
+    (2, 'CPU temperature monitor setting in config_app', [
+        add_column('config_app', 'cpu_temp_monitor', 'BOOLEAN DEFAULT 0'),
+    ]),
+    (3, 'Run telemetry in site_event', [
+        add_column('site_event', 'telemetry', 'BLOB'),
+    ]),
+]
+
+
+def schema_version() -> int:
+    """ Version of the database schema, 0 when no migration has been applied """
+    return db.session.scalar(select(func.max(SchemaVersion.version))) or 0
+
+
+def upgrade_database():
+    """ Upgrade an existing database in place to the latest schema version, keeping its data """
+    db.create_all()  # only creates missing tables
+    current_version = schema_version()
+    for version, description, steps in migrations:
+        if version <= current_version:
+            continue
+        with db.engine.begin() as conn:
+            for step in steps:
+                step(conn)
+        db.session.add(SchemaVersion(version=version, description=description))
+        db.session.commit()
+        log.info(f'upgrade_database: applied schema version {version} "{description}"')
+    return schema_version()
@@ -0,0 +1,63 @@
+import os
+import socket
+import threading
+from time import monotonic, sleep
+from . import log, boot_started
+from .flaskconfig import FlaskConfig
+
+
+def notify_ready():
+    """ Tell systemd that the service is ready when it was started as a Type=notify service """
+    log.info(f'server listening {round(monotonic() - boot_started, 3)} secs after start')
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return
+    if address.startswith('@'):
+        address = '\0' + address[1:]   # abstract socket namespace
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(b'READY=1')
+    except OSError as err:
+        log.warning(f'server.notify_ready - {err}')
+
+
+def notify_when_listening(host: str, port: int, timeout=60.0):
+    """ Notify readiness from a background thread as soon as host:port accepts connections, for a server which
+        binds its socket only when it runs """
+    def probe():
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            try:
+                with socket.create_connection((host, port), timeout=0.5):
+                    notify_ready()
+                    return
+            except OSError:
+                sleep(0.05)
+        log.warning(f'server.notify_when_listening - {host}:{port} not listening after {timeout} secs')
+
+    threading.Thread(target=probe, daemon=True).start()
+
+
+def serve_wsgi(flask_app, host: str, port: int, config_class=FlaskConfig):
+    """ Run the Flask app on the waitress production server: one process with a bounded thread pool,
+        so the windlass and other module level singletons are shared by all requests """
+    from waitress import create_server
+    log.info(f'serving in wsgi mode on {host}:{port} with {config_class.wsgi_threads} threads')
+    server = create_server(flask_app, host=host, port=port, threads=config_class.wsgi_threads,
+                           backlog=config_class.wsgi_backlog, connection_limit=config_class.wsgi_connection_limit,
+                           channel_timeout=config_class.wsgi_channel_timeout, ident='anchorapp')
+    notify_ready()
+    server.run()
+
+
+def run_server(flask_app, mode: str, host: str, port: int, debug=False):
+    """ Serve the Flask app in one of the modes: 'dev', 'wsgi' or 'asgi' """
+    if mode == 'asgi':
+        from .asgi import serve_asgi
+        serve_asgi(flask_app, host=host, port=port)
+    elif mode == 'wsgi':
+        serve_wsgi(flask_app, host=host, port=port)
+    else:
+        notify_when_listening(host, port)   # the development server binds the socket in run
+        flask_app.run(host=host, port=port, debug=debug)
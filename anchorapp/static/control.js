@@ -0,0 +1,237 @@
+// Control pages: the buttons call the JSON API and the page is updated in place from the returned state.
+// The links still work without JavaScript.
+
+function show_message(message, category) {
+    const messages = document.getElementById("messages");
+    if (!messages) {
+        return;
+    }
+    messages.replaceChildren();
+    if (message) {
+        const alert = document.createElement("div");
+        alert.className = "alert alert-" + category;
+        alert.textContent = message;
+        messages.append(alert);
+    }
+}
+
+function set_value(id, value) {
+    const element = document.getElementById(id);
+    if (!element) {
+        return;
+    }
+    if (element.tagName === "INPUT") {
+        element.value = value;
+    } else {
+        element.textContent = value;
+    }
+}
+
+function apply_state(state) {
+    set_value("target_length", state.target_length);
+    set_value("actual_length", state.actual_length);
+    // data-state names the flag which makes the button the primary one, a leading ! inverts it
+    document.querySelectorAll("[data-state]").forEach(function (button) {
+        const name = button.dataset.state;
+        let enabled = name.startsWith("!") ? !state[name.slice(1)] : state[name];
+        if (button.dataset.action === "resume") {
+            enabled = state.run_ok || state.resume_ok;
+            button.innerHTML = state.run_ok ? "&nbsp &nbsp Run &nbsp &nbsp" : "Resume";
+        }
+        button.classList.toggle("btn-primary", enabled);
+        button.classList.toggle("btn-outline-info", !enabled);
+    });
+    const image = document.getElementById("direction_img");
+    if (image) {
+        image.hidden = !state.direction_img;
+        if (state.direction_img) {
+            image.src = state.direction_img;
+        }
+    }
+    show_message(state.message, state.category);
+}
+
+function apply_reply(state, status) {
+    if (status === 403) {
+        window.location.href = "/control/info";
+        return;
+    }
+    if (state.error) {
+        state.message = state.error;
+        state.category = "warning";
+    }
+    apply_state(state);
+}
+
+function api_call(url, options) {
+    return fetch(url, options).then(function (response) {
+        return response.json().then(function (state) {
+            apply_reply(state, response.status);
+        });
+    }).catch(function () {
+        show_message("No connection with the anchor server", "danger");
+    });
+}
+
+// Command channel: in asgi mode the page keeps a websocket open for the commands and the pushed state changes,
+// and reconnects after a growing delay. Without the channel the commands use fetch and the event stream.
+// A pause or status which is not acknowledged in time is sent again with fetch and the channel is reopened, an
+// idle channel is checked with a ping: a half-open connection may not be closed by the browser for a long time.
+// The other commands are not sent again, the server would carry out a nudge or a resume which did arrive twice.
+const websocket_path = document.currentScript.dataset.websocket;
+const ACK_TIMEOUT_MS = 400;
+const PING_INTERVAL_MS = 5000;
+const RESEND_COMMANDS = ["pause", "status"];
+let channel = null;
+let command_id = 0;
+let reconnect_delay = 500;
+let last_push = null;
+const acks = new Map();    // command id: function to call with the reply, or with null when there is none
+
+function http_command(command) {
+    const url = command === "status" ? "/api/v1/status" : "/api/v1/anchor/" + command;
+    return api_call(url, command === "status" ? {} : {method: "POST"});
+}
+
+function send_command(command) {
+    if (!channel) {
+        return http_command(command);
+    }
+    const socket = channel;
+    command_id += 1;
+    const id = command_id;
+    socket.send(JSON.stringify({id: id, cmd: command}));
+    return new Promise(function (resolve) {
+        const timer = setTimeout(function () {
+            acks.delete(id);
+            resolve(null);
+        }, ACK_TIMEOUT_MS);
+        acks.set(id, function (reply) {
+            clearTimeout(timer);
+            resolve(reply);
+        });
+    }).then(function (reply) {
+        if (!reply) {
+            abandon_channel(socket);
+            if (RESEND_COMMANDS.includes(command)) {
+                show_message("No connection with the anchor server", "danger");
+                return http_command(command);
+            }
+            if (command !== "ping") {
+                return http_command("status").then(function () {
+                    show_message("No reply from the anchor server, check whether " + command + " was done", "warning");
+                });
+            }
+        } else if (reply.state) {
+            apply_reply(reply.state, reply.ok || reply.state.control ? 200 : 403);
+        }
+    });
+}
+
+function on_push(state) {
+    set_value("actual_length", state.actual_length);
+    const changed = !last_push || state.running !== last_push.running || state.paused !== last_push.paused ||
+        state.target_length !== last_push.target_length;
+    last_push = state;
+    if (changed || state.completed) {
+        refresh_status();
+    }
+}
+
+function open_channel() {
+    const protocol = window.location.protocol === "https:" ? "wss://" : "ws://";
+    const socket = new WebSocket(protocol + window.location.host + websocket_path);
+    socket.onopen = function () {
+        channel = socket;
+        reconnect_delay = 500;
+        stop_stream();
+    };
+    socket.onmessage = function (event) {
+        const message = JSON.parse(event.data);
+        if ("ack" in message) {
+            const resolve = acks.get(message.ack);
+            acks.delete(message.ack);
+            if (resolve) {
+                resolve(message);
+            }
+        } else if (message.push) {
+            on_push(message.push);
+        }
+    };
+    socket.onclose = function () {
+        acks.forEach(function (resolve) {
+            resolve(null);
+        });
+        acks.clear();
+        abandon_channel(socket);
+    };
+}
+
+function abandon_channel(socket) {
+    // closed or not answering: use fetch and the event stream until a new channel is open
+    if (socket.abandoned) {
+        return;
+    }
+    socket.abandoned = true;
+    if (channel === socket) {
+        channel = null;
+        last_push = null;
+        get_stream();
+    }
+    socket.close();
+    setTimeout(open_channel, reconnect_delay);
+    reconnect_delay = Math.min(reconnect_delay * 2, 10000);
+}
+
+document.querySelectorAll("a[data-action]").forEach(function (button) {
+    button.addEventListener("click", function (event) {
+        event.preventDefault();
+        send_command(button.dataset.action);
+    });
+});
+
+// the status books a completed run, refresh it once at a time
+let completing = false;
+
+function refresh_status() {
+    if (!completing) {
+        completing = true;
+        send_command("status").finally(function () {
+            completing = false;
+        });
+    }
+}
+
+// stream event listener: the actual length while running, -1000 when the run has completed
+let source = null;
+
+function get_stream() {
+    if (source) {
+        return;
+    }
+    source = new EventSource("/stream_actual");
+    source.onmessage = function (event) {
+        if (event.data > -1000) {
+            set_value("actual_length", event.data);
+        } else {
+            refresh_status();
+        }
+    }
+}
+
+function stop_stream() {
+    if (source) {
+        source.close();
+        source = null;
+    }
+}
+
+get_stream()
+if (websocket_path) {
+    open_channel();
+    setInterval(function () {
+        if (channel && acks.size === 0) {
+            send_command("ping");
+        }
+    }, PING_INTERVAL_MS);
+}
@@ -0,0 +1,72 @@
+""" Startup profile: the import time per module of the app and the time from starting run_anchor.py until the
+    first page is served, on a new and on an existing database.
+    Usage: python benchmarks/bench_boot.py [--mode dev] [--runs 3] [--top 15] """
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+
+
+def import_profile(top: int) -> list:
+    """ Top level packages and app modules with the largest cumulative import time (ms) """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import anchorapp.app_logic.main'],
+                            cwd=repo_dir, capture_output=True, text=True, check=True).stderr
+    modules = dict()
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        if '.' not in name or name.startswith('anchorapp.'):
+            modules[name] = max(modules.get(name, 0.0), round(int(cumulative) / 1000, 1))
+    ordered = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{'module': name, 'ms': ms} for name, ms in ordered]
+
+
+def first_page(mode: str, db_dir: str, port: int, timeout=30.0) -> dict:
+    """ Start the server, poll until / is served and read the boot time reported by /ready """
+    start = time.monotonic()
+    server = subprocess.Popen([sys.executable, os.path.join(bench_dir, 'serve.py'), db_dir,
+                               '--mode', mode, '--port', str(port)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.monotonic() - start < timeout:
+            request_start = time.monotonic()
+            try:
+                with urllib.request.urlopen(f'http://localhost:{port}/', timeout=5) as response:
+                    response.read()
+                break
+            except OSError:
+                time.sleep(0.02)
+        first_page_secs = time.monotonic() - start
+        first_request_ms = (time.monotonic() - request_start) * 1000
+        with urllib.request.urlopen(f'http://localhost:{port}/ready', timeout=5) as response:
+            ready = json.loads(response.read())
+    finally:
+        server.terminate()
+        server.wait()
+    return {'first_page_secs': round(first_page_secs, 3), 'first_request_ms': round(first_request_ms, 1),
+            'warmed_up_secs': ready['boot_secs']}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=('dev', 'wsgi', 'asgi'), default='dev')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--port', type=int, default=5081)
+    args = parser.parse_args()
+    results = {'imports': import_profile(args.top), 'new_database': [], 'existing_database': []}
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as db_dir:
+            results['new_database'].append(first_page(args.mode, db_dir, args.port))
+            results['existing_database'].append(first_page(args.mode, db_dir, args.port))
+    print(json.dumps(results, indent=2))
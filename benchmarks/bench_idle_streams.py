@@ -0,0 +1,80 @@
+""" Memory and thread count of the server with idle /stream_actual subscribers, per serving mode.
+    Usage: python benchmarks/bench_idle_streams.py [--clients 50] [--modes dev asgi] """
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def proc_status(pid: int) -> dict:
+    """ Resident memory (kB) and number of threads of a process """
+    status = dict()
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'Threads'):
+                status[key] = int(value.split()[0])
+    return {'rss_kb': status['VmRSS'], 'threads': status['Threads']}
+
+
+def wait_for_port(port: int, timeout=15.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(('localhost', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f'server did not listen on port {port}')
+
+
+def open_stream(port: int) -> socket.socket:
+    """ Open an event stream and read its first event """
+    sock = socket.create_connection(('localhost', port))
+    sock.sendall(b'GET /stream_actual HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n')
+    data = b''
+    while b'data:' not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ConnectionError('stream closed')
+        data += chunk
+    return sock
+
+
+def bench_mode(mode: str, clients: int, port: int) -> dict:
+    with tempfile.TemporaryDirectory() as db_dir:
+        server = subprocess.Popen([sys.executable, os.path.join(bench_dir, 'serve.py'), db_dir,
+                                   '--mode', mode, '--port', str(port)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(port)
+            time.sleep(0.5)
+            before = proc_status(server.pid)
+            streams = [open_stream(port) for _ in range(clients)]
+            time.sleep(2.0)
+            after = proc_status(server.pid)
+            for sock in streams:
+                sock.close()
+        finally:
+            server.terminate()
+            server.wait()
+    return {'mode': mode, 'clients': clients, 'idle': before, 'with_clients': after,
+            'rss_kb_per_client': round((after['rss_kb'] - before['rss_kb']) / clients, 1),
+            'threads_per_client': round((after['threads'] - before['threads']) / clients, 2)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--modes', nargs='+', default=['dev', 'asgi'])
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    results = [bench_mode(mode, args.clients, args.port + i) for i, mode in enumerate(args.modes)]
+    print(json.dumps(results, indent=2))
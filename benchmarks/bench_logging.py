@@ -0,0 +1,88 @@
+""" Cost per log call in the calling thread: the former logger (synchronous console handler, new formatter per record)
+    against the queued logger with the cached formatters, writing to a slow console.
+    Usage: python benchmarks/bench_logging.py [--calls 5000] [--write-delay-ms 0.2] """
+
+import os
+import sys
+import json
+import logging
+import argparse
+from time import sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from anchorapp import CustomLogFormatter, RateLimitFilter  # noqa: E402
+from common import timed, summary  # noqa: E402
+
+
+class SlowStream:
+    """ Console stand-in which takes delay seconds per write, like a serial console or a busy journal """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def write(self, text):
+        if self.delay:
+            sleep(self.delay)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class FormatterPerRecord(logging.Formatter):
+    """ The former formatter, which created a new Formatter for every record """
+
+    def format(self, record):
+        return logging.Formatter(CustomLogFormatter.formats.get(record.levelno)).format(record)
+
+
+def sync_logger(stream) -> logging.Logger:
+    logger = logging.getLogger('bench.sync')
+    logger.propagate = False
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(FormatterPerRecord())
+    logger.addHandler(handler)
+    return logger
+
+
+def queued_logger(stream, rate_limit: bool):
+    import queue
+    from logging.handlers import QueueHandler, QueueListener
+    logger = logging.getLogger(f'bench.queued.{rate_limit}')
+    logger.propagate = False
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(CustomLogFormatter())
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    if rate_limit:
+        queue_handler.addFilter(RateLimitFilter(5, 1.0))
+    logger.addHandler(queue_handler)
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    return logger, listener
+
+
+def run(calls: int, write_delay_ms: float) -> list:
+    stream = SlowStream(write_delay_ms / 1000)
+    results = list()
+    logger = sync_logger(stream)
+    logger.setLevel(logging.DEBUG)
+    durations = timed(lambda: logger.debug('windlass.run_anchor - actual length 12.3m'), calls)
+    results.append({'logger': 'sync, formatter per record', **summary(durations)})
+    for rate_limit in (False, True):
+        logger, listener = queued_logger(stream, rate_limit)
+        logger.setLevel(logging.DEBUG)
+        durations = timed(lambda: logger.debug('windlass.run_anchor - actual length 12.3m'), calls)
+        listener.stop()
+        name = 'queued, cached formatters' + (', rate limited' if rate_limit else '')
+        results.append({'logger': name, **summary(durations)})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=5000)
+    parser.add_argument('--write-delay-ms', type=float, default=0.2)
+    args = parser.parse_args()
+    print(json.dumps(run(args.calls, args.write_delay_ms), indent=2))
@@ -0,0 +1,97 @@
+""" Tap to relay off: the time from sending a pause until its response, per channel, against a server in asgi mode.
+    The relay is switched off before the response is sent, so this is an upper bound of the time to relay off.
+    Channels: the former /anchor/pause route on a new and on a kept-alive connection, also with the page reload
+    after the redirect, the JSON API and the websocket command channel. Requires the websockets package.
+    Usage: python benchmarks/bench_pause.py [--pauses 30] [--run-secs 0.15] [--port 5082] """
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import http.client
+from websockets.sync.client import connect
+from bench_idle_streams import wait_for_port
+from common import summary
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def request(conn: http.client.HTTPConnection, method: str, url: str, body: dict = None) -> int:
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    conn.request(method, url, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = conn.getresponse()
+    response.read()
+    return response.status
+
+
+def measure(pause, resume, pauses: int, run_secs: float) -> list:
+    """ Start a run, let it run for run_secs, then time the pause """
+    durations = list()
+    for _ in range(pauses):
+        resume()
+        time.sleep(run_secs)
+        start = time.perf_counter()
+        pause()
+        durations.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.05)
+    return durations
+
+
+def run(port: int, pauses: int, run_secs: float) -> list:
+    control = http.client.HTTPConnection('localhost', port)
+    request(control, 'GET', '/')                 # the first visitor gets control
+    request(control, 'POST', '/api/v1/target', {'depth': 18})
+
+    def resume():
+        request(control, 'POST', '/api/v1/anchor/resume')
+
+    def http_new_connection(follow_redirect=False):
+        conn = http.client.HTTPConnection('localhost', port)
+        request(conn, 'GET', '/anchor/pause')
+        if follow_redirect:
+            request(conn, 'GET', '/')            # the browser reloads the control page before it shows the result
+        conn.close()
+
+    kept_alive = http.client.HTTPConnection('localhost', port)
+    results = list()
+    for name, pause in (('/anchor/pause and the redirected page, new connection', lambda: http_new_connection(True)),
+                        ('/anchor/pause, new connection', http_new_connection),
+                        ('/anchor/pause, kept-alive connection', lambda: request(kept_alive, 'GET', '/anchor/pause')),
+                        ('/api/v1/anchor/pause, kept-alive connection',
+                         lambda: request(kept_alive, 'POST', '/api/v1/anchor/pause'))):
+        results.append({'channel': name, **summary(measure(pause, resume, pauses, run_secs))})
+    with connect(f'ws://localhost:{port}/ws') as websocket:
+        command_id = 0
+
+        def command(cmd: str):
+            nonlocal command_id
+            command_id += 1
+            websocket.send(json.dumps({'id': command_id, 'cmd': cmd}))
+            while 'ack' not in (reply := json.loads(websocket.recv())):
+                pass                             # a pushed state change
+            assert reply['ack'] == command_id and reply['ok'], reply
+
+        results.append({'channel': 'websocket', **summary(measure(lambda: command('pause'), lambda: command('resume'),
+                                                                  pauses, run_secs))})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pauses', type=int, default=30)
+    parser.add_argument('--run-secs', type=float, default=0.15)
+    parser.add_argument('--port', type=int, default=5082)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as db_dir:
+        server = subprocess.Popen([sys.executable, os.path.join(bench_dir, 'serve.py'), db_dir,
+                                   '--mode', 'asgi', '--port', str(args.port)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(args.port)
+            print(json.dumps(run(args.port, args.pauses, args.run_secs), indent=2))
+        finally:
+            server.terminate()
+            server.wait()
@@ -0,0 +1,31 @@
+""" Anchoring scenario on the virtual clock: the lengths and relay on time after each step, and the wall time
+    against the simulated time. The default scenario drops 40 m with a pause, nudges and pulls the anchor up.
+    Usage: python benchmarks/bench_simulation.py [--repeat 20] [--scenario scenario.json]
+    A scenario file holds a list of [action, value] steps, see anchorapp/app_logic/simulation.py """
+
+import json
+import logging
+import argparse
+from common import timed, summary
+from anchorapp.app_logic.simulation import run_scenario, DEFAULT_SCENARIO
+
+
+def run(steps, repeat: int) -> dict:
+    result = run_scenario(steps)
+    durations = timed(lambda: run_scenario(steps), repeat)
+    wall = summary(durations)
+    simulated_secs = result['final']['simulated_secs']
+    return result | {'wall': wall, 'speedup': round(simulated_secs * 1000 / wall['mean_ms'])}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--scenario', help='JSON file with a list of [action, value] steps')
+    args = parser.parse_args()
+    scenario = DEFAULT_SCENARIO
+    if args.scenario:
+        with open(args.scenario) as file:
+            scenario = [tuple(step) for step in json.load(file)]
+    logging.getLogger('anchorapp').setLevel(logging.WARNING)
+    print(json.dumps(run(scenario, args.repeat), indent=2))
@@ -0,0 +1,58 @@
+""" SiteEvent write latency and history page latency, with the default SQLite settings and with the storage profile.
+    The events are written as the app does: write_event, and journal.flush to wait for the commit.
+    Usage: python benchmarks/bench_storage.py [--events 2000] """
+
+import sys
+import json
+import logging
+import argparse
+import tempfile
+import subprocess
+from time import perf_counter
+
+
+def run_profile(profile: str, events: int) -> dict:
+    from common import create_test_app, timed, summary
+    pragmas = {} if profile == 'default' else None
+    with tempfile.TemporaryDirectory() as db_dir:
+        config = {'sqlite_pragmas': pragmas} if pragmas is not None else {}
+        if profile == 'default':
+            config['SQLALCHEMY_ENGINE_OPTIONS'] = {}
+        app = create_test_app(db_dir, **config)
+        logging.getLogger('anchorapp').setLevel(logging.WARNING)
+        from anchorapp.models.db_model import Action
+        from anchorapp.app_logic.util import write_event
+        from anchorapp.app_logic.journal import journal
+        client = app.test_client()
+        client.get('/')
+        with app.test_request_context('/', environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+
+            def write_one():
+                write_event(Action.PAUSE)
+                journal.flush()
+
+            write_ms = timed(write_one, events)
+            start = perf_counter()
+            for _ in range(events):
+                write_event(Action.PAUSE)
+            journal.flush()
+            written_per_sec = round(events / (perf_counter() - start))
+        history_ms = timed(lambda: client.get('/history'), 20)
+    return {'profile': profile, 'write_event_and_flush': summary(write_ms), 'batched_written_per_sec': written_per_sec,
+            'history_page': summary(history_ms)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--profile', choices=('default', 'tuned'))
+    args = parser.parse_args()
+    if args.profile:
+        print(json.dumps(run_profile(args.profile, args.events)))
+    else:
+        results = list()
+        for profile in ('default', 'tuned'):  # separate processes, the engine settings are per process
+            output = subprocess.run([sys.executable, __file__, '--profile', profile, '--events', str(args.events)],
+                                    capture_output=True, text=True, check=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+        print(json.dumps(results, indent=2))
@@ -0,0 +1,75 @@
+""" Requests per second and latency of the page routes, per serving mode.
+    Usage: python benchmarks/bench_throughput.py [--clients 4] [--seconds 5] [--modes dev wsgi asgi] """
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from statistics import quantiles
+from bench_idle_streams import wait_for_port
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+routes = ('/', '/help', '/about', '/history')
+
+
+def client_loop(port: int, route: str, end_time: float, latencies: list):
+    """ Send requests over one keep-alive connection until end_time """
+    conn = http.client.HTTPConnection('localhost', port, timeout=10)
+    while time.monotonic() < end_time:
+        start = time.perf_counter()
+        conn.request('GET', route)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.getheader('connection', '').lower() == 'close':
+            conn.close()
+            conn = http.client.HTTPConnection('localhost', port, timeout=10)
+    conn.close()
+
+
+def bench_route(port: int, route: str, clients: int, seconds: float) -> dict:
+    latencies = list()
+    end_time = time.monotonic() + seconds
+    threads = [threading.Thread(target=client_loop, args=(port, route, end_time, latencies)) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    percentiles = quantiles(latencies, n=100)
+    return {'route': route, 'requests': len(latencies), 'req_per_sec': round(len(latencies) / seconds, 1),
+            'p50_ms': round(percentiles[49] * 1000, 2), 'p95_ms': round(percentiles[94] * 1000, 2)}
+
+
+def bench_mode(mode: str, clients: int, seconds: float, port: int) -> dict:
+    with tempfile.TemporaryDirectory() as db_dir:
+        server = subprocess.Popen([sys.executable, os.path.join(bench_dir, 'serve.py'), db_dir,
+                                   '--mode', mode, '--port', str(port)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(port)
+            for route in routes:  # first visit creates the database records
+                conn = http.client.HTTPConnection('localhost', port, timeout=10)
+                conn.request('GET', route)
+                conn.getresponse().read()
+                conn.close()
+            results = [bench_route(port, route, clients, seconds) for route in routes]
+        finally:
+            server.terminate()
+            server.wait()
+    return {'mode': mode, 'clients': clients, 'routes': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--modes', nargs='+', default=['dev', 'wsgi', 'asgi'])
+    parser.add_argument('--port', type=int, default=8775)
+    args = parser.parse_args()
+    print(json.dumps([bench_mode(mode, args.clients, args.seconds, args.port + i)
+                      for i, mode in enumerate(args.modes)], indent=2))
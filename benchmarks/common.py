@@ -0,0 +1,39 @@
+""" Helpers to run the Flask app in-process on a temporary SQLite database """
+
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from anchorapp import create_app, FlaskConfig  # noqa: E402
+
+
+def create_test_app(db_dir: str, **config):
+    """ Flask app with the database in db_dir, CSRF protection off and config overrides as keyword arguments """
+    FlaskConfig.db_dev_path = db_dir
+    config_class = type('BenchConfig', (FlaskConfig,), {'WTF_CSRF_ENABLED': False, **config})
+    app = create_app(config_class)
+    app.app_context().push()
+    from anchorapp.models.db_model import create_database
+    from anchorapp.models.migrations import upgrade_database
+    create_database()
+    upgrade_database()
+    return app
+
+
+def timed(func, repeat: int) -> list:
+    """ Call func repeat times, return the durations in milliseconds """
+    durations = list()
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        durations.append((perf_counter() - start) * 1000)
+    return durations
+
+
+def summary(durations: list) -> dict:
+    """ Mean, median and 95th percentile of durations """
+    ordered = sorted(durations)
+    return {'n': len(ordered), 'mean_ms': round(sum(ordered) / len(ordered), 3),
+            'p50_ms': round(ordered[len(ordered) // 2], 3), 'p95_ms': round(ordered[int(len(ordered) * 0.95)], 3)}
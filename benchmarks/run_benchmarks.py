@@ -0,0 +1,160 @@
+""" Benchmark suite of the hot paths, in-process with the Flask test client, a temporary SQLite database and
+    the gpiozero mock pins (selected automatically when not on the Raspberri Pi):
+    the home page, pause to relay off, write_event throughput, the recent sites and the history on a large
+    synthetic history, and the cost of the event stream fan-out per subscriber.
+    The results are written as JSON, to compare runs over time.
+    Usage: python benchmarks/run_benchmarks.py [--output results.json] [--events 50000] [--sites 200] """
+
+import os
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timedelta, timezone
+from common import create_test_app, timed, summary
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def bench_home(client, repeat: int) -> dict:
+    """ Render time of the control page """
+    client.get('/')
+    return summary(timed(lambda: client.get('/'), repeat))
+
+
+def bench_pause(client, pauses: int) -> dict:
+    """ Arrival to relay off as recorded by the app, and the full request, for /anchor/pause and the JSON API """
+    from anchorapp.app_logic.util import Glob
+    from anchorapp.app_logic.windlass import relay
+    client.post('/api/v1/target', json={'depth': 18})
+    results = dict()
+    for name, pause in (('/anchor/pause', lambda: client.get('/anchor/pause')),
+                        ('/api/v1/anchor/pause', lambda: client.post('/api/v1/anchor/pause'))):
+        relay_off_ms = list()
+        request_ms = list()
+        for _ in range(pauses):
+            client.post('/api/v1/anchor/resume')
+            time.sleep(0.05)
+            start = time.perf_counter()
+            pause()
+            request_ms.append((time.perf_counter() - start) * 1000)
+            relay_off_ms.append(Glob.pause_latency_ms)
+            assert not relay.anchor_dn_switch.is_active and not relay.anchor_up_switch.is_active
+        results[name] = {'relay_off': summary(relay_off_ms), 'request': summary(request_ms)}
+        time.sleep(0.3)      # let the background log of the last pause finish
+    return results
+
+
+def bench_write_event(app, events: int) -> dict:
+    """ Events queued per second by write_event, and including the write of the journal to the database """
+    from anchorapp.models.db_model import Action
+    from anchorapp.app_logic.util import write_event
+    from anchorapp.app_logic.journal import journal
+    with app.test_request_context('/', environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+        journal.flush()
+        start = time.perf_counter()
+        for _ in range(events):
+            write_event(Action.ADJUST_TARGET)
+        queued = time.perf_counter() - start
+        journal.flush()
+        written = time.perf_counter() - start
+    return {'events': events, 'queued_per_sec': round(events / queued), 'written_per_sec': round(events / written)}
+
+
+def add_history(events: int, sites: int):
+    """ Synthetic history: sites with events over the last 20 weeks, half of the events at the first site """
+    from sqlalchemy import insert
+    from anchorapp import db
+    from anchorapp.models.db_model import Site, SiteEvent, Action
+    db.session.execute(insert(Site), [{'id': site_id, 'user_id': 1, 'refname': f'bay {site_id}',
+                                       'actual_length': 0.0} for site_id in range(1, sites + 1)])
+    start = datetime.now() - timedelta(weeks=20)
+    step = timedelta(weeks=20) / events
+    actions = (Action.SET_TARGET.value, Action.DOWN_TO_TARGET.value, Action.PAUSE.value, Action.ADJUST_ACTUAL.value)
+    rows = list()
+    for n in range(events):
+        site_id = 1 if n % 2 else n % sites + 1
+        start_time = start + n * step
+        rows.append({'site_id': site_id, 'boat_id': 1, 'user_id': 1, 'action': actions[n % len(actions)],
+                     'start_time': start_time, 'end_time': start_time, 'target_length': 20.0,
+                     'start_actual_length': 10.0, 'end_actual_length': 12.0})
+    db.session.execute(insert(SiteEvent), rows)
+    db.session.commit()
+
+
+def bench_history(client, events: int, sites: int, repeat: int) -> dict:
+    """ Recent sites, selected and cached, and the history of the busiest site: all events and the first page """
+    from anchorapp.app_logic.util import Glob
+    from anchorapp.app_logic.main import find_existing_sites, get_site_events
+    add_history(events, sites)
+
+    def select_sites():
+        Glob.recent_sites = None
+        return find_existing_sites()
+
+    return {'events': events, 'sites': sites,
+            'find_existing_sites': summary(timed(select_sites, repeat)),
+            'find_existing_sites_cached': summary(timed(find_existing_sites, repeat)),
+            'get_site_events_all': summary(timed(lambda: sum(1 for _ in get_site_events(1)), 5)),
+            'get_site_events_page': summary(timed(lambda: list(get_site_events(1, limit=100)), repeat)),
+            'history_page': summary(timed(lambda: client.get('/history?site_id=1'), repeat))}
+
+
+def bench_fanout(subscriber_counts: tuple, values: int) -> list:
+    """ Time to publish one value of the event stream, in total and per subscriber """
+    from anchorapp.app_logic.stream_hub import StreamHub
+    results = list()
+    for count in subscriber_counts:
+        hub = StreamHub(lambda: '0.0', tick_secs=3600)
+        subscribers = [hub.subscribe() for _ in range(count)]
+        durations = timed(lambda: hub.publish('12.3'), values)
+        for subscriber in subscribers:
+            hub.unsubscribe(subscriber)
+        result = summary(durations)
+        results.append({'subscribers': count, **result,
+                        'per_subscriber_us': round(result['mean_ms'] * 1000 / count, 2)})
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> dict:
+    with tempfile.TemporaryDirectory() as db_dir:
+        app = create_test_app(db_dir)
+        logging.getLogger('anchorapp').setLevel(logging.WARNING)
+        client = app.test_client()
+        results = {'home_page': bench_home(client, args.repeat),
+                   'pause': bench_pause(client, args.pauses),
+                   'write_event': bench_write_event(app, args.write_events),
+                   'history': bench_history(client, args.events, args.sites, args.repeat),
+                   'stream_fanout': bench_fanout((1, 10, 50, 100), args.repeat)}
+    meta = {'time': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'revision': git_revision(),
+            'host': platform.node(), 'machine': platform.machine(), 'python': platform.python_version(),
+            'parameters': vars(args)}
+    return {'meta': meta, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    parser.add_argument('--repeat', type=int, default=100, help='repetitions of the timed calls')
+    parser.add_argument('--pauses', type=int, default=20)
+    parser.add_argument('--write-events', type=int, default=5000)
+    parser.add_argument('--events', type=int, default=50000, help='events of the synthetic history')
+    parser.add_argument('--sites', type=int, default=200, help='sites of the synthetic history')
+    args = parser.parse_args()
+    output = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
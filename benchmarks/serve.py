@@ -0,0 +1,15 @@
+""" Start run_anchor.py with the SQLite database in a temporary directory.
+    Usage: python benchmarks/serve.py <db-dir> [run_anchor.py arguments] """
+
+import os
+import sys
+import runpy
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+from anchorapp import FlaskConfig  # noqa: E402
+
+FlaskConfig.db_dev_path = sys.argv[1]
+sys.argv = [os.path.join(repo_dir, 'run_anchor.py')] + sys.argv[2:]
+runpy.run_path(sys.argv[0], run_name='__main__')
@@ -1,8 +1,12 @@
 #!/usr/bin/python3
 import os
 import platform
+import argparse
 from anchorapp import create_app, FlaskConfig, log
-from anchorapp.models.db_model import create_database
+from anchorapp.server import run_server
+from anchorapp.models.db_model import create_database, log_storage_profile
+from anchorapp.models.migrations import upgrade_database
+from anchorapp.app_logic.main import warm_up
 
 app = create_app()
 app.app_context().push()
@@ -10,12 +14,19 @@ db_path_and_name = FlaskConfig.sqlite_path_and_name()
 if not os.path.isfile(db_path_and_name):
     create_database()
     log.info(f'Created new SQLite database {db_path_and_name}')
+upgrade_database()
+log_storage_profile(FlaskConfig.sqlite_pragmas)
 
 if __name__ == '__main__':
+    warm_up(app)
+    parser = argparse.ArgumentParser(description='Anchor Remote server')
+    parser.add_argument('--mode', choices=('dev', 'wsgi', 'asgi'), default=FlaskConfig.server_mode, help='serving mode')
+    parser.add_argument('--port', type=int, default=FlaskConfig.server_port)
+    args = parser.parse_args()
     if platform.system() == 'Windows':
         os.system('color')
     host_name = platform.node()
     raspberri_host_name = FlaskConfig.prod_server
     host = '10.42.0.1' if host_name == raspberri_host_name else 'localhost'
     # host = '0.0.0.0' if host_name == raspberri_host_name else 'localhost'
-    app.run(host=host, port=80)
+    run_server(app, args.mode, host=host, port=args.port)
@@ -0,0 +1,65 @@
+""" Booking of the windlass runs: each completed run is booked on the event which started it, also when the
+    next run was started before the status was asked. Runs the app on a temporary SQLite database with the
+    gpiozero mock pins. Usage: python -m pytest tests """
+
+import time
+import pytest
+from anchorapp import create_app, FlaskConfig, db
+from anchorapp.models.db_model import SiteEvent, Action, create_database
+from anchorapp.models.migrations import upgrade_database
+from anchorapp.app_logic.util import Glob
+from anchorapp.app_logic.journal import journal
+
+
+@pytest.fixture
+def client(tmp_path):
+    FlaskConfig.db_dev_path = str(tmp_path)
+    app = create_app(type('TestConfig', (FlaskConfig,), {'WTF_CSRF_ENABLED': False}))
+    with app.app_context():
+        create_database()
+        upgrade_database()
+        yield app.test_client()
+        Glob.windlass.quit_listener()
+        journal.stop()
+
+
+def wait_for(predicate, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < end, 'timed out'
+        time.sleep(0.01)
+
+
+def run_events() -> list:
+    journal.flush()
+    db.session.expire_all()
+    return SiteEvent.query.filter(SiteEvent.action == Action.DOWN_TO_TARGET.value).order_by(SiteEvent.id).all()
+
+
+def test_resume_after_pause_without_status(client):
+    client.get('/')
+    client.post('/api/v1/target', json={'depth': 18})
+    client.post('/api/v1/anchor/resume')
+    wait_for(lambda: Glob.windlass.running)
+    time.sleep(0.3)
+    client.post('/api/v1/anchor/pause')
+    wait_for(lambda: not Glob.windlass.running)
+    first_length = Glob.windlass.actual_length
+    client.post('/api/v1/anchor/resume')              # no status in between
+    wait_for(lambda: Glob.windlass.running)
+    time.sleep(0.3)
+
+    assert client.get('/api/v1/status').get_json()['running']
+    first, second = run_events()
+    assert first.end_actual_length is None            # not booked while the next run is going on
+    assert second.end_actual_length is None
+
+    client.post('/api/v1/anchor/pause')
+    wait_for(lambda: not Glob.windlass.running)
+    client.get('/api/v1/status')
+    first, second = run_events()
+    assert first.end_actual_length == first_length
+    assert second.start_actual_length == first_length
+    assert second.end_actual_length == Glob.windlass.actual_length > first_length
+    assert first.telemetry is not None and second.telemetry is not None
+    assert client.get(f'/telemetry/{first.id}').status_code == 200